@@ -1,12 +1,27 @@
 #!/usr/bin/env python3
 import os
+import re
 import sys
 import time
 import signal
+import atexit
+import functools
+import resource
 import shutil
+import errno
 import json
+import math
+import struct
+import argparse
+import select
+import socket
+import queue
+import uuid
 import subprocess
 import threading
+import urllib.parse
+from array import array
+from collections import deque
 from datetime import datetime
 
 # Constants
@@ -16,944 +31,4365 @@ OUTPUT_DIR = os.path.expanduser("~/Desktop/acestream_recordings")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 FFMPEG_BIN = shutil.which("ffmpeg")
+FFPROBE_BIN = shutil.which("ffprobe")
 PLAYER_BIN = shutil.which(PLAYER)
 
 # Get the directory where the script is located
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 CHANNELS_FILE = os.path.join(SCRIPT_DIR, "channels.json")
 
+# Write a keyframe index next to each recording (used by the "clip" command)
+WRITE_INDEX = True
+
+# Live preview: keep a rolling HLS playlist of the last few seconds of every
+# recording in "<file>.ts.hls/" (also served by the control API)
+LIVE_PREVIEW = True
+HLS_SEGMENT_SECONDS = 2
+HLS_WINDOW = 5
+HLS_WRITE_FILES = True
+
+# Output of the player and ffmpeg children is kept in a ring buffer of
+# CHILD_LOG_BYTES per process; when a job fails the last CHILD_LOG_KEEP bytes
+# of each are written to "<recording>.stderr.log"
+CHILD_LOG_BYTES = 64 * 1024
+CHILD_LOG_KEEP = 16 * 1024
+
+# Output volumes: directories on other disks to spread recordings over (also
+# ACESTREAM_VOLUMES, separated by ":"). Recordings left at the default output
+# directory go to the volume with room for them and the lowest write latency
+# per running recording; finished ones are moved off volumes that fill up.
+OUTPUT_VOLUMES = [p for p in os.environ.get("ACESTREAM_VOLUMES", "").split(os.pathsep) if p]
+VOLUME_MIN_FREE = 2 << 30
+VOLUME_PROBE_INTERVAL = 60
+REBALANCE = True
+REBALANCE_THRESHOLD = 0.15
+REBALANCE_MBPS = 400
+
+# Archival transcode: instead of the stream copy, re-encode finished recordings
+# into a smaller mp4. The file is split at keyframes into chunks of about
+# ARCHIVE_CHUNK_SECONDS that are encoded in parallel (one single-threaded ffmpeg
+# per CPU, fewer while recordings run) and joined without re-encoding.
+ARCHIVE = False
+ARCHIVE_CHUNK_SECONDS = 120
+ARCHIVE_WORKERS = None
+ARCHIVE_VIDEO_ARGS = ["-c:v", "libx264", "-preset", "medium", "-crf", "23"]
+ARCHIVE_AUDIO_ARGS = ["-c:a", "copy"]
+ARCHIVE_DELETE_SOURCE = False
+
+# Reload the channel list automatically when channels.json changes
+WATCH_CHANNELS = True
+
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                         "acestream-recorder")
+
+# The last channel list shown, so the window can be filled before channels.json
+# has been parsed (the file is then read in the background)
+CHANNEL_SNAPSHOT = os.path.join(CACHE_DIR, "channels.json")
+
+# Thumbnails: contact sheets of THUMBNAIL_COUNT evenly spaced keyframes of a
+# finished recording, cached by content and evicted least recently used first
+# beyond THUMBNAIL_CACHE_BYTES. Channel rows show their latest recording; with
+# THUMBNAIL_LIVE, channels never recorded are probed through the engine.
+THUMBNAILS = True
+THUMBNAIL_DIR = os.path.join(CACHE_DIR, "thumbnails")
+THUMBNAIL_CACHE_BYTES = 256 << 20
+THUMBNAIL_COUNT = 8
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_ROW = (4, 64)
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_LIVE = False
+THUMBNAIL_LIVE_TTL = 3600
+
+# Startup benchmark ("startup-bench"): median seconds allowed to import the
+# module in a fresh interpreter and to show the window
+STARTUP_BUDGET = {"import": 0.15, "window": 1.5}
+
+# Fast start: pull the stream straight from the engine HTTP API while the engine
+# and output file are still being prepared; the player is only used as fallback
+FAST_START = True
+ENGINE_API = "http://127.0.0.1:6878"
+ENGINE_ADDR = ("127.0.0.1", 6878)
+ENGINE_START_TIMEOUT = 15
+STREAM_STALL_TIMEOUT = 30
+PREALLOCATE_MBPS = 8
+
+# Distributed recording: finished files are listed in <output dir>/catalog.jsonl;
+# workers advertise MAX_JOBS slots and, if set, their uplink in Mbit/s
+CATALOG_NAME = "catalog.jsonl"
+MAX_JOBS = 4
+WORKER_BANDWIDTH_MBPS = None
+
 # Utilities
 def safe_name(s: str) -> str:
     keep = "".join(c if (c.isalnum() or c in " _-") else "_" for c in s)
     return "_".join(keep.split())[:80]
 
-def ensure_engine():
+def disk_free(path):
+    # Free bytes on the filesystem that holds (or will hold) path
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return 0
+
+def engine_ready():
+    try:
+        socket.create_connection(ENGINE_ADDR, timeout=0.2).close()
+        return True
+    except OSError:
+        return False
+
+def start_engine():
+    # Launch the engine if needed without waiting for it; True if it was launched
     try:
+        if engine_ready():
+            return False
         if shutil.which("pgrep"):
             rc = subprocess.call(["pgrep", "-f", "acestreamplayer.engine"], 
                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            if rc != 0:
-                subprocess.Popen([ENGINE], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                time.sleep(2)
-        else:
-            subprocess.Popen([ENGINE], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            time.sleep(2)
+            if rc == 0:
+                return False
+        subprocess.Popen([ENGINE], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return True
     except Exception:
-        pass
+        return False
 
-# Try GTK (PyGObject) first
-USE_GTK = False
-try:
-    import gi
-    gi.require_version("Gtk", "3.0")
-    from gi.repository import Gtk, Gdk, GLib
-    USE_GTK = True
-except Exception:
-    USE_GTK = False
-
-# If no GTK, try ttkbootstrap
-if not USE_GTK:
+def wait_for_engine(timeout=None):
+    deadline = time.time() + (ENGINE_START_TIMEOUT if timeout is None else timeout)
+    while not engine_ready():
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+def ensure_engine():
+    # Returns as soon as a freshly started engine accepts connections
+    if start_engine():
+        wait_for_engine()
+
+# ---------------- Instrumentation ----------------
+# Opt-in phase timing written as Chrome trace JSON (chrome://tracing, Perfetto).
+# Enable with --trace FILE or ACESTREAM_TRACE=FILE; --profile/ACESTREAM_PROFILE=1
+# adds cProfile stats (FILE.prof) and --tracemalloc/ACESTREAM_TRACEMALLOC=1 adds
+# heap snapshots (FILE.<label>.tracemalloc) plus memory counters in the trace.
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = repr(exc)
+        self.tracer.complete(self.name, self.start, time.perf_counter(), **self.args)
+        return False
+
+class Tracer:
+    def __init__(self):
+        self.path = None
+        self.events = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.threads = set()
+        self.profiles = []
+        self.shared_profile = None
+        self.shared_users = 0
+        self.profile = False
+        self.malloc = False
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def configure(self, path, profile=False, malloc=False):
+        self.path = path
+        self.profile = profile
+        self.malloc = malloc
+        if malloc:
+            import tracemalloc
+            tracemalloc.start()
+        atexit.register(self.save)
+
+    def _event(self, event):
+        tid = threading.get_ident()
+        event.update(pid=os.getpid(), tid=tid)
+        with self.lock:
+            if tid not in self.threads:
+                self.threads.add(tid)
+                self.events.append({"name": "thread_name", "ph": "M", "pid": event["pid"], "tid": tid,
+                                    "args": {"name": threading.current_thread().name}})
+            self.events.append(event)
+
+    def _us(self, t):
+        return round((t - self.origin) * 1e6, 1)
+
+    def span(self, name, **args):
+        if self.path is None:
+            return _NoSpan()
+        return _Span(self, name, args)
+
+    def complete(self, name, start, end, **args):
+        if self.path is not None:
+            self._event({"name": name, "cat": "phase", "ph": "X", "ts": self._us(start),
+                         "dur": self._us(end) - self._us(start), "args": args})
+
+    def instant(self, name, **args):
+        if self.path is not None:
+            self._event({"name": name, "cat": "mark", "ph": "i", "s": "t",
+                         "ts": self._us(time.perf_counter()), "args": args})
+
+    def profiled(self, fn):
+        # Before Python 3.12 cProfile only sees the thread that enabled it, so
+        # every decorated thread entry point collects its own profile. From 3.12
+        # it sits on sys.monitoring, which allows one active profiler for the
+        # whole interpreter: a single shared profile then runs while any
+        # decorated call does. save() merges them either way.
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if self.path is None or not self.profile:
+                return fn(*args, **kwargs)
+            if sys.version_info >= (3, 12):
+                return self._run_shared(fn, args, kwargs)
+            import cProfile
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError:
+                # Another profiling tool is active; run unprofiled
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                prof.disable()
+                with self.lock:
+                    self.profiles.append(prof)
+        return wrapper
+
+    def _run_shared(self, fn, args, kwargs):
+        import cProfile
+        with self.lock:
+            if self.shared_profile is None:
+                self.shared_profile = cProfile.Profile()
+                self.profiles.append(self.shared_profile)
+            active = True
+            if self.shared_users == 0:
+                try:
+                    self.shared_profile.enable()
+                except ValueError:
+                    active = False
+            if active:
+                self.shared_users += 1
+        if not active:
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.shared_users -= 1
+                if self.shared_users == 0:
+                    self.shared_profile.disable()
+
+    def memory_snapshot(self, label):
+        if self.path is None or not self.malloc:
+            return
+        import tracemalloc
+        current, peak = tracemalloc.get_traced_memory()
+        self._event({"name": "python_heap", "ph": "C", "ts": self._us(time.perf_counter()),
+                     "args": {"current": current, "peak": peak}})
+        tracemalloc.take_snapshot().dump(f"{self.path}.{safe_name(label)}.tracemalloc")
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            events = list(self.events)
+            profiles = list(self.profiles)
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+            if profiles:
+                import pstats
+                pstats.Stats(*profiles).dump_stats(self.path + ".prof")
+        except Exception:
+            pass
+
+TRACER = Tracer()
+
+# ---------------- Child output ----------------
+class ChildOutput:
+    # Reads a child's stderr on its own thread into a fixed-size ring buffer
+    # and picks status values out of it; memory stays bounded however long
+    # and chatty the process is.
+    PATTERNS = [
+        ("buffering", re.compile(r"buffer\w*\D{0,20}?(\d{1,3}(?:\.\d+)?)\s*%", re.I), float),
+        ("peers", re.compile(r"\bpeers?\W{0,3}(\d+)", re.I), int),
+        ("speed", re.compile(r"\bspeed\W{0,3}(\d+(?:\.\d+)?\s*(?:x|[kKmM]i?B/s|[kKmM]bit/s|[kKmM]b/s))"), str),
+    ]
+    ERROR = re.compile(r"\b(error|failed|fatal|cannot|could not|unable to)\b", re.I)
+    MAX_LINE = 1024
+
+    def __init__(self, label, size=CHILD_LOG_BYTES, on_metrics=None):
+        self.label = label
+        self.size = size
+        self.on_metrics = on_metrics
+        self.metrics = {}
+        self.errors = 0
+        self.total = 0
+        self._buf = bytearray(size)
+        self._end = 0
+        self._line = b""
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def attach(self, stream):
+        self._thread = threading.Thread(target=self._read, args=(stream,), daemon=True,
+                                        name=f"output-{self.label}")
+        self._thread.start()
+        return self
+
+    def join(self, timeout=2):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _read(self, stream):
+        fd = stream.fileno()
+        try:
+            while True:
+                data = os.read(fd, 4096)
+                if not data:
+                    break
+                self.feed(data)
+        except OSError:
+            pass
+        finally:
+            stream.close()
+
+    def feed(self, data):
+        with self._lock:
+            if len(data) >= self.size:
+                self._buf[:] = data[-self.size:]
+                self._end = 0
+            else:
+                first = min(len(data), self.size - self._end)
+                self._buf[self._end:self._end + first] = data[:first]
+                self._buf[:len(data) - first] = data[first:]
+                self._end = (self._end + len(data)) % self.size
+            self.total += len(data)
+        self._parse(data)
+
+    def _parse(self, data):
+        # ffmpeg rewrites its progress line with \r, so both end a line
+        lines = re.split(rb"[\r\n]", self._line + data)
+        self._line = lines.pop()[-self.MAX_LINE:]
+        updates = {}
+        for raw in lines:
+            line = raw[:self.MAX_LINE].decode("utf-8", "replace").strip()
+            if not line:
+                continue
+            for key, pattern, convert in self.PATTERNS:
+                m = pattern.search(line)
+                if m:
+                    updates[key] = convert(m.group(1))
+            if self.ERROR.search(line):
+                self.errors += 1
+                updates["errors"] = self.errors
+                updates["last_error"] = line[:200]
+        if updates:
+            self.metrics.update(updates)
+            if self.on_metrics is not None:
+                self.on_metrics(updates)
+
+    def tail(self, n=None):
+        with self._lock:
+            n = min(n or self.size, self.size, self.total)
+            if n == 0:
+                return b""
+            start = (self._end - n) % self.size
+            if start < self._end:
+                return bytes(self._buf[start:self._end])
+            return bytes(self._buf[start:]) + bytes(self._buf[:self._end])
+
+def format_metrics(metrics):
+    parts = []
+    if "buffering" in metrics:
+        parts.append(f"buffering {metrics['buffering']:.0f}%")
+    if "peers" in metrics:
+        parts.append(f"{metrics['peers']} peers")
+    if "speed" in metrics:
+        parts.append(f"speed {metrics['speed']}")
+    if metrics.get("errors"):
+        parts.append(f"{metrics['errors']} errors")
+    return ", ".join(parts)
+
+# ---------------- Resource isolation ----------------
+# Limits per job class. cpu_weight/io_weight are cgroup v2 weights (1-10000,
+# default 100), cpu_quota is a percentage of one CPU and memory_max is in bytes;
+# these need a systemd user manager on cgroup v2. nice, ionice (best-effort
+# level 0-7) and cpus (CPU affinity) are applied in every case; without cgroups
+# address_space_max (RLIMIT_AS) is the only memory cap available. All of them
+# are set by wrapper commands (nice, ionice, taskset, prlimit).
+RESOURCE_LIMITS = {
+    "ingest": {
+        "cpu_weight": 200, "cpu_quota": None, "memory_max": 1 << 30, "io_weight": 200,
+        "nice": 0, "ionice": 4, "cpus": None, "address_space_max": None,
+    },
+    "conversion": {
+        "cpu_weight": 50, "cpu_quota": 200, "memory_max": 2 << 30, "io_weight": 50,
+        "nice": 10, "ionice": 7, "cpus": None, "address_space_max": None,
+    },
+    # Applied to every chunk encoder of an archival transcode
+    "archive": {
+        "cpu_weight": 10, "cpu_quota": 100, "memory_max": 1 << 30, "io_weight": 10,
+        "nice": 19, "ionice": 7, "cpus": None, "address_space_max": None,
+    },
+    "thumbnail": {
+        "cpu_weight": 10, "cpu_quota": 50, "memory_max": 512 << 20, "io_weight": 10,
+        "nice": 19, "ionice": 7, "cpus": None, "address_space_max": None,
+    },
+}
+
+_systemd_scopes = None
+
+def systemd_scopes_available():
+    global _systemd_scopes
+    if _systemd_scopes is None:
+        _systemd_scopes = False
+        try:
+            if os.path.exists("/sys/fs/cgroup/cgroup.controllers") and shutil.which("systemd-run"):
+                rc = subprocess.call(["systemd-run", "--user", "--scope", "--quiet", "true"],
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5)
+                _systemd_scopes = rc == 0
+        except Exception:
+            pass
+    return _systemd_scopes
+
+class ResourceGroup:
+    _counter = 0
+
+    def __init__(self, job_class, name=""):
+        ResourceGroup._counter += 1
+        self.job_class = job_class
+        self.limits = RESOURCE_LIMITS.get(job_class, {})
+        self.unit = f"acestream-{job_class}-{os.getpid()}-{ResourceGroup._counter}"
+        if name:
+            self.unit += "-" + safe_name(name)[:24]
+        self.scoped = systemd_scopes_available()
+        self.pid = None
+        self.cgroup = None
+        self.started = time.time()
+        self.cpu_seconds = 0.0
+        self.memory_peak = 0
+        self.io_read = 0
+        self.io_write = 0
+
+    def wrap(self, cmd):
+        limits = self.limits
+        prefix = []
+        if self.scoped:
+            prefix = ["systemd-run", "--user", "--scope", "--quiet", "--collect", f"--unit={self.unit}"]
+            if limits.get("cpu_weight"):
+                prefix += ["-p", f"CPUWeight={limits['cpu_weight']}"]
+            if limits.get("cpu_quota"):
+                prefix += ["-p", f"CPUQuota={limits['cpu_quota']}%"]
+            if limits.get("memory_max"):
+                prefix += ["-p", f"MemoryMax={limits['memory_max']}"]
+            if limits.get("io_weight"):
+                prefix += ["-p", f"IOWeight={limits['io_weight']}"]
+        # Each wrapper execs the next, so the pid stays that of the command.
+        # No preexec_fn: running Python between fork and exec can deadlock in
+        # a process with as many threads as this one.
+        if limits.get("ionice") is not None and shutil.which("ionice"):
+            prefix += ["ionice", "-c", "2", "-n", str(limits["ionice"])]
+        if limits.get("nice") and shutil.which("nice"):
+            prefix += ["nice", "-n", str(limits["nice"])]
+        if limits.get("cpus") and shutil.which("taskset"):
+            prefix += ["taskset", "-c", ",".join(str(c) for c in limits["cpus"])]
+        if limits.get("address_space_max") and not self.scoped and shutil.which("prlimit"):
+            prefix += ["prlimit", f"--as={limits['address_space_max']}"]
+        return prefix + list(cmd)
+
+    def popen(self, cmd, **kwargs):
+        # The wrappers would hide a missing binary behind their own exit status
+        if shutil.which(cmd[0]) is None:
+            raise FileNotFoundError(cmd[0])
+        proc = subprocess.Popen(self.wrap(cmd), start_new_session=True, **kwargs)
+        self.pid = proc.pid
+        return proc
+
+    def sample(self):
+        # The scope and /proc entries vanish with the process, so the last
+        # sample taken while it runs is what usage() reports.
+        if self.pid is None:
+            return
+        try:
+            if self.scoped and self.cgroup is None:
+                with open(f"/proc/{self.pid}/cgroup") as f:
+                    path = f.read().strip().split("::", 1)[-1]
+                if self.unit in path:
+                    self.cgroup = "/sys/fs/cgroup" + path
+            if self.cgroup:
+                self._sample_cgroup()
+            else:
+                self._sample_proc()
+        except Exception:
+            pass
+
+    def _sample_cgroup(self):
+        with open(os.path.join(self.cgroup, "cpu.stat")) as f:
+            for line in f:
+                key, value = line.split()
+                if key == "usage_usec":
+                    self.cpu_seconds = int(value) / 1e6
+        for name in ("memory.peak", "memory.current"):
+            try:
+                with open(os.path.join(self.cgroup, name)) as f:
+                    self.memory_peak = max(self.memory_peak, int(f.read()))
+                break
+            except OSError:
+                continue
+        read = write = 0
+        try:
+            with open(os.path.join(self.cgroup, "io.stat")) as f:
+                for line in f:
+                    for field in line.split()[1:]:
+                        key, _, value = field.partition("=")
+                        if key == "rbytes":
+                            read += int(value)
+                        elif key == "wbytes":
+                            write += int(value)
+        except OSError:
+            pass
+        self.io_read, self.io_write = max(self.io_read, read), max(self.io_write, write)
+
+    def _sample_proc(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        self.cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    self.memory_peak = max(self.memory_peak, int(line.split()[1]) * 1024)
+        with open(f"/proc/{self.pid}/io") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key == "read_bytes":
+                    self.io_read = int(value)
+                elif key == "write_bytes":
+                    self.io_write = int(value)
+
+    def usage(self):
+        return {
+            "class": self.job_class,
+            "isolation": "cgroup" if self.cgroup else "nice",
+            "wall_seconds": round(time.time() - self.started, 1),
+            "cpu_seconds": round(self.cpu_seconds, 1),
+            "memory_peak": self.memory_peak,
+            "io_read": self.io_read,
+            "io_write": self.io_write,
+        }
+
+def format_usage(usage):
+    mb = 1024 * 1024
+    # Values that were not measured are None and left out
+    parts = [f"cpu {usage['cpu_seconds']:.1f}s"]
+    if usage.get("memory_peak") is not None:
+        parts.append(f"mem {usage['memory_peak'] / mb:.0f} MB")
+    if usage.get("io_read") is not None:
+        parts.append(f"io {usage['io_read'] / mb:.0f}/{usage['io_write'] / mb:.0f} MB r/w")
+    elif usage.get("io_write") is not None:
+        parts.append(f"wrote {usage['io_write'] / mb:.0f} MB")
+    return f"{usage['class']}: " + ", ".join(parts)
+
+def convert_to_mp4(output_ts, log=None):
+    # -> (ok, usage); ffmpeg's stderr goes to log (a ChildOutput) if given
+    mp4_path = os.path.splitext(output_ts)[0] + ".mp4"
+    group = ResourceGroup("conversion", os.path.basename(output_ts))
+    log = log or ChildOutput("conversion")
+    with TRACER.span("conversion", output=mp4_path):
+        try:
+            conv_cmd = [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", "-stats",
+                        "-i", output_ts, "-c", "copy", mp4_path]
+            conv_proc = group.popen(conv_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE)
+            log.attach(conv_proc.stderr)
+            while True:
+                group.sample()
+                try:
+                    conv_proc.wait(timeout=0.5)
+                    break
+                except subprocess.TimeoutExpired:
+                    continue
+            log.join()
+            return conv_proc.returncode == 0, group.usage()
+        except Exception:
+            return False, group.usage()
+
+# ---------------- Fast start ----------------
+def preallocate(fd, length):
+    # FALLOC_FL_KEEP_SIZE reserves extents without exposing zeros to readers
+    # tailing the file; unused space is released by the final ftruncate
     try:
-        import ttkbootstrap as tb
-        from ttkbootstrap.constants import *
-        TB_AVAILABLE = True
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+        return libc.fallocate(fd, 1, 0, length) == 0
     except Exception:
-        TB_AVAILABLE = False
-        import tkinter as tk
-        from tkinter import messagebox
+        return False
 
-# ---------------- GTK UI Implementation ----------------
-if USE_GTK:
-    class GTKApp:
-        def __init__(self):
-            self.builder = None
-            self.window = Gtk.Window(title="AceStream Recorder — GTK")
-            self.window.set_default_size(900, 650)
-            self.window.connect("destroy", Gtk.main_quit)
-            
-            # State
-            self.links = []
-            self.displayed_indices = []
-            self.selected_index = -1
-            self.current_proc = None
-            self.current_pg = None
-            self.stop_flag = False
-            self.minuts = 60
-            self.shutdown_after = False
-            self.output_dir = OUTPUT_DIR
-            
-            # UI
-            self._build_ui()
-            self.load_links()
-        
-        def _build_ui(self):
-            main = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
-            self.window.add(main)
-            
-            # Top controls
-            top = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
-            main.pack_start(top, False, False, 6)
-            
-            btn_refresh = Gtk.Button(label="Refresh")
-            btn_refresh.connect("clicked", lambda w: threading.Thread(target=self.load_links, daemon=True).start())
-            top.pack_start(btn_refresh, False, False, 0)
-            
-            btn_record = Gtk.Button(label="Record Selected")
-            btn_record.connect("clicked", lambda w: self.on_record_selected())
-            top.pack_start(btn_record, False, False, 0)
-            
-            btn_stop = Gtk.Button(label="Stop Recording")
-            btn_stop.connect("clicked", lambda w: self.stop_recording())
-            top.pack_start(btn_stop, False, False, 0)
-            
-            # Search + minutes + shutdown
-            search_area = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
-            main.pack_start(search_area, False, False, 0)
-            
-            lbl_search = Gtk.Label(label="Search:")
-            search_area.pack_start(lbl_search, False, False, 0)
-            
-            self.search_entry = Gtk.SearchEntry()
-            self.search_entry.set_hexpand(True)
-            self.search_entry.connect("search-changed", lambda w: self.on_search_changed())
-            search_area.pack_start(self.search_entry, True, True, 0)
-            
-            lbl_minutes = Gtk.Label(label="Minutes:")
-            search_area.pack_start(lbl_minutes, False, False, 0)
-            
-            self.spin_minutes = Gtk.SpinButton()
-            self.spin_minutes.set_range(1, 1440)
-            self.spin_minutes.set_value(60)
-            search_area.pack_start(self.spin_minutes, False, False, 0)
-            
-            self.shutdown_chk = Gtk.CheckButton(label="Shutdown at end (30s wait)")
-            search_area.pack_start(self.shutdown_chk, False, False, 0)
-            
-            # Output directory selector
-            dir_area = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
-            main.pack_start(dir_area, False, False, 6)
-            
-            lbl_dir = Gtk.Label(label="Destination directory:")
-            dir_area.pack_start(lbl_dir, False, False, 0)
-            
-            self.entry_output_dir = Gtk.Entry()
-            self.entry_output_dir.set_text(OUTPUT_DIR)
-            self.entry_output_dir.set_hexpand(True)
-            dir_area.pack_start(self.entry_output_dir, True, True, 0)
-            
-            btn_browse = Gtk.Button(label="Browse...")
-            btn_browse.connect("clicked", lambda w: self._browse_directory())
-            dir_area.pack_start(btn_browse, False, False, 0)
-            
-            # List area (scrolled)
-            list_frame = Gtk.Frame(label="Channels (select 1)")
-            main.pack_start(list_frame, True, True, 0)
-            
-            scrolled = Gtk.ScrolledWindow()
-            scrolled.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
-            list_frame.add(scrolled)
-            
-            self.listbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
-            scrolled.add_with_viewport(self.listbox)
-            
-            # Custom link
-            custom_frame = Gtk.Frame(label="Custom link")
-            main.pack_start(custom_frame, False, False, 0)
-            
-            cf = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
-            custom_frame.add(cf)
-            
-            self.entry_custom = Gtk.Entry()
-            cf.pack_start(self.entry_custom, True, True, 0)
-            
-            btn_custom = Gtk.Button(label="Record Custom")
-            btn_custom.connect("clicked", lambda w: self.on_record_custom())
-            cf.pack_start(btn_custom, False, False, 0)
-            
-            # Status label
-            self.status_label = Gtk.Label(label="Ready")
-            main.pack_start(self.status_label, False, False, 6)
-            
-            self.window.show_all()
-        
-        def _browse_directory(self):
-            dialog = Gtk.FileChooserDialog(
-                title="Select destination directory",
-                parent=self.window,
-                action=Gtk.FileChooserAction.SELECT_FOLDER
-            )
-            dialog.add_buttons(
-                Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
-                Gtk.STOCK_OPEN, Gtk.ResponseType.OK
-            )
-            
-            response = dialog.run()
-            if response == Gtk.ResponseType.OK:
-                selected = dialog.get_filename()
-                self.entry_output_dir.set_text(selected)
-            
-            dialog.destroy()
-        
-        def set_status(self, text):
-            GLib.idle_add(self.status_label.set_text, text)
-        
-        def on_search_changed(self):
-            self.populate_list(self.search_entry.get_text())
-        
-        def load_links(self):
+def find_ts_start(buf):
+    # Offset of the first packet followed by two more sync bytes, or -1
+    pos = buf.find(bytes([TS_SYNC]))
+    while 0 <= pos <= len(buf) - 2 * TS_PACKET - 1:
+        if buf[pos + TS_PACKET] == TS_SYNC and buf[pos + 2 * TS_PACKET] == TS_SYNC:
+            return pos
+        pos = buf.find(bytes([TS_SYNC]), pos + 1)
+    return -1
+
+class FastStartRecording:
+    # Ingest runs on threads of this process, so it has no resource scope of
+    # its own: usage() covers those threads, and the engine's stat URL stands
+    # in for the player output that feeds the metrics on the fallback path
+    CHUNK = 64 * 1024
+    STATS_INTERVAL = 2
+
+    def __init__(self, hashid, output_ts, minutes):
+        self.hashid = hashid
+        self.output_ts = output_ts
+        self.minutes = minutes
+        self.url = f"{ENGINE_API}/ace/getstream?id={hashid}&pid={uuid.uuid4().hex}"
+        self.stat_url = None
+        self.response = None
+        self.ttfb = None
+        self.bytes_written = 0
+        self.on_first_byte = None
+        self.on_stats = None
+        self.started = None
+        self.cpu_seconds = 0.0
+        self._stopped = threading.Event()
+        self._chunks = queue.Queue(maxsize=64)
+
+    @staticmethod
+    def _thread_cpu():
+        if not hasattr(resource, "RUSAGE_THREAD"):
+            return 0.0
+        ru = resource.getrusage(resource.RUSAGE_THREAD)
+        return ru.ru_utime + ru.ru_stime
+
+    def _connect(self):
+        with TRACER.span("engine_start", hash=self.hashid):
+            start_engine()
+            ready = wait_for_engine()
+        if not ready or self._stopped.is_set():
+            return
+        with TRACER.span("request_stream", hash=self.hashid):
             try:
-                # Read from local channels.json file
-                if not os.path.exists(CHANNELS_FILE):
-                    self.set_status(f"Error: channels.json file not found at {CHANNELS_FILE}")
+                import urllib.request
+                url = self.url
+                # The JSON form also returns the session's stat URL; an engine
+                # that ignores it answers with the stream itself
+                with urllib.request.urlopen(url + "&format=json", timeout=STREAM_STALL_TIMEOUT) as resp:
+                    if "json" in resp.headers.get("Content-Type", ""):
+                        session = json.loads(resp.read(1 << 16)).get("response") or {}
+                        url = session.get("playback_url") or url
+                        self.stat_url = session.get("stat_url")
+                if self._stopped.is_set():
                     return
-                
-                with open(CHANNELS_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                if not isinstance(data, list):
-                    raise ValueError("JSON is not a list")
-                
-                # Convert to the expected format
-                self.links = []
-                for item in data:
-                    channel = item.get("channel", "")
-                    link = item.get("link", "")
-                    
-                    # Remove acestream:// prefix if present for storage
-                    hash_id = link.replace("acestream://", "") if link else ""
-                    
-                    # Store in the format expected by the rest of the code
-                    self.links.append({
-                        "channel": channel,
-                        "link": hash_id,
-                        "work": True  # Assume all channels work
-                    })
-                
-                GLib.idle_add(self.populate_list, self.search_entry.get_text())
-                self.set_status(f"{len(self.links)} channels loaded from local file")
-            except Exception as e:
-                self.set_status(f"Error loading channels: {e}")
-        
-        def populate_list(self, filter_text):
-            # clear children
-            for child in self.listbox.get_children():
-                self.listbox.remove(child)
-            
-            ft = (filter_text or "").strip().lower()
-            first_radio = None
-            
-            for idx, item in enumerate(self.links):
-                channel = item.get("channel", f"channel_{idx}")
-                link = item.get("link", "")
-                works = bool(item.get("work", False))
-                
-                if ft:
-                    if ft not in channel.lower() and ft not in (link or "").lower():
-                        continue
-                
-                row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
-                self.listbox.pack_start(row, False, False, 2)
-                
-                # Create radiobutton with correct group
-                if first_radio is None:
-                    rb = Gtk.RadioButton.new_with_label_from_widget(None, "")
-                    first_radio = rb
-                else:
-                    rb = Gtk.RadioButton.new_with_label_from_widget(first_radio, "")
-                
-                # Mark if previously selected
-                if idx == self.selected_index:
-                    rb.set_active(True)
-                
-                row.pack_start(rb, False, False, 0)
-                
-                lbl_text = f"{channel}   [{link}]"
-                lbl = Gtk.Label(label=lbl_text, xalign=0)
-                
-                if not works:
-                    lbl.set_markup(f"<span foreground='red'>{GLib.markup_escape_text(lbl_text)}</span>")
-                
-                row.pack_start(lbl, True, True, 0)
-                
-                # set radio toggled callback to update selected_index
-                def on_toggle(rb_button, idx=idx):
-                    if rb_button.get_active():
-                        self.selected_index = idx
-                
-                rb.connect("toggled", on_toggle)
-            
-            self.listbox.show_all()
-        
-        def on_record_selected(self):
-            if self.selected_index == -1:
-                self.set_status("No channel selected.")
-                return
-            
+                response = urllib.request.urlopen(url, timeout=STREAM_STALL_TIMEOUT)
+                self.response = response
+                # run() may have given up and called stop() while this was opening;
+                # stop() sets the flag before it closes self.response
+                if self._stopped.is_set():
+                    response.close()
+                    self.response = None
+            except Exception:
+                self.response = None
+
+    def _read(self):
+        try:
+            while True:
+                data = self.response.read1(self.CHUNK)
+                if not data:
+                    break
+                self._chunks.put(data)
+        except Exception:
+            pass
+        self.cpu_seconds += self._thread_cpu()
+        self._chunks.put(None)
+
+    def _poll_stats(self, done):
+        while not done.wait(self.STATS_INTERVAL):
             try:
-                item = self.links[self.selected_index]
+                stat = http_json("GET", self.stat_url, timeout=3).get("response") or {}
             except Exception:
-                self.set_status("Invalid selection")
-                return
-            
-            link = item.get("link", "")
-            channel = item.get("channel", "Unknown")
-            
-            if not link:
-                self.set_status("Invalid hash")
-                return
+                continue
+            updates = {}
+            if stat.get("peers") is not None:
+                updates["peers"] = int(stat["peers"])
+            if stat.get("speed_down") is not None:
+                updates["speed"] = f"{stat['speed_down']}KiB/s"
+            if stat.get("status") == "prebuf" and stat.get("progress") is not None:
+                updates["buffering"] = float(stat["progress"])
+            if updates and self.on_stats is not None:
+                self.on_stats(updates)
+
+    def usage(self):
+        return {
+            "class": "ingest",
+            "isolation": "in-process",
+            "wall_seconds": round(time.time() - self.started, 1) if self.started else 0,
+            "cpu_seconds": round(self.cpu_seconds, 1),
+            "memory_peak": None,
+            "io_read": None,
+            "io_write": self.bytes_written,
+        }
+
+    def stop(self):
+        self._stopped.set()
+        try:
+            if self.response is not None:
+                self.response.close()
+        except Exception:
+            pass
+
+    def run(self, should_stop):
+        # -> True/False, or None when the engine API is unreachable and the
+        # caller should fall back to the player
+        t0 = time.perf_counter()
+        start = self.started = time.time()
+        cpu_start = self._thread_cpu()
+        done = threading.Event()
+        connector = threading.Thread(target=self._connect, daemon=True)
+        connector.start()
+        
+        # Open the output while the engine starts and looks for peers
+        with TRACER.span("open_output"):
+            f = open(self.output_ts, "wb", buffering=0)
+            preallocate(f.fileno(), self.minutes * 60 * PREALLOCATE_MBPS * 125000)
+        
+        try:
+            while connector.is_alive():
+                if should_stop():
+                    return False
+                connector.join(0.2)
+            if self.response is None:
+                f.close()
+                os.remove(self.output_ts)
+                return None
             
-            # Update output directory
-            self.output_dir = self.entry_output_dir.get_text()
-            if not os.path.exists(self.output_dir):
+            threading.Thread(target=self._read, daemon=True).start()
+            if self.stat_url and self.on_stats is not None:
+                threading.Thread(target=self._poll_stats, args=(done,), daemon=True).start()
+            total = self.minutes * 60
+            pending = b""
+            while not should_stop() and time.time() - start < total:
                 try:
-                    os.makedirs(self.output_dir, exist_ok=True)
-                except Exception as e:
-                    self.set_status(f"Error creating directory: {e}")
-                    return
-            
-            minutes = int(self.spin_minutes.get_value_as_int())
-            self.set_status(f"Starting recording: {channel}")
-            self._set_ui_sensitive(False)
-            self.stop_flag = False
-            
-            thread = threading.Thread(
-                target=self._record_sequence, 
-                args=([(channel, link)], minutes, self.shutdown_chk.get_active()), 
-                daemon=True
-            )
-            thread.start()
-        
-        def on_record_custom(self):
-            val = self.entry_custom.get_text().strip()
-            if not val:
-                self.set_status("Enter hash or acestream://hash")
+                    data = self._chunks.get(timeout=0.4)
+                except queue.Empty:
+                    continue
+                if data is None:
+                    break
+                if self.ttfb is None:
+                    # Drop anything before the first valid TS packet
+                    pending += data
+                    pos = find_ts_start(pending)
+                    if pos < 0:
+                        pending = pending[-2 * TS_PACKET:]
+                        continue
+                    data, pending = pending[pos:], b""
+                    self.ttfb = time.perf_counter() - t0
+                    TRACER.complete("first_byte", t0, time.perf_counter(), hash=self.hashid)
+                    if self.on_first_byte:
+                        self.on_first_byte(self.ttfb)
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(f.fileno(), view):]
+                self.bytes_written += len(data)
+            if self.ttfb is not None:
+                TRACER.complete("recording", t0 + self.ttfb, time.perf_counter(), hash=self.hashid)
+            return self.bytes_written > 0
+        finally:
+            done.set()
+            self.stop()
+            self.cpu_seconds += self._thread_cpu() - cpu_start
+            if not f.closed:
+                with TRACER.span("finalize", bytes=self.bytes_written):
+                    os.ftruncate(f.fileno(), self.bytes_written)
+                    f.close()
+
+# ---------------- MPEG-TS keyframe index ----------------
+# While a recording is written, a sidecar "<file>.ts.tsidx" collects the PTS and
+# byte offset of every video random access point as packed little-endian uint64
+# pairs, so clips can be cut with direct range reads instead of a full scan.
+TS_PACKET = 188
+TS_SYNC = 0x47
+PTS_CLOCK = 90000
+PTS_WRAP = 1 << 33
+INDEX_SUFFIX = ".tsidx"
+INDEX_MAGIC = b"ASIX"
+INDEX_VERSION = 2
+# magic, version, flags, bytes of the recording covered by the index
+INDEX_HEADER = struct.Struct("<4sHHQ")
+VIDEO_STREAM_TYPES = {0x01, 0x02, 0x10, 0x1B, 0x24}
+
+def index_path(ts_path):
+    return ts_path + INDEX_SUFFIX
+
+def parse_timecode(value):
+    # "90", "1:30", "01:02:03.5" -> seconds
+    seconds = 0.0
+    for part in str(value).strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(f"Negative time: {value}")
+    return seconds
+
+def _is_keyframe_payload(stream_type, payload):
+    # Fallback for streams that never set random_access_indicator
+    pos = payload.find(b"\x00\x00\x01")
+    while 0 <= pos < len(payload) - 3:
+        code = payload[pos + 3]
+        if stream_type == 0x1B and (code & 0x1F) in (5, 7):
+            return True
+        if stream_type == 0x24 and 16 <= ((code >> 1) & 0x3F) <= 23:
+            return True
+        if stream_type in (0x01, 0x02) and code == 0xB3:
+            return True
+        pos = payload.find(b"\x00\x00\x01", pos + 3)
+    return False
+
+class TsScanner:
+    def __init__(self):
+        self.pmt_pids = set()
+        self.video_pid = None
+        self.video_type = None
+        self.pts_base = 0
+        self.last_raw_pts = None
+        self.psi = {}
+
+    def feed(self, buf, offset):
+        # buf must start on a packet boundary; returns [(pts, byte_offset), ...]
+        found = []
+        end = len(buf) - len(buf) % TS_PACKET
+        # Only packets with payload_unit_start set can carry PSI or a PES header
+        flags = buf[1:end:TS_PACKET]
+        for n, b1 in enumerate(flags):
+            if not b1 & 0x40:
+                continue
+            pos = n * TS_PACKET
+            if buf[pos] != TS_SYNC:
+                continue
+            pid = ((b1 & 0x1F) << 8) | buf[pos + 2]
+            afc = (buf[pos + 3] >> 4) & 0x3
+            p = pos + 4
+            rai = False
+            if afc & 0x2:
+                alen = buf[p]
+                rai = alen > 0 and bool(buf[p + 1] & 0x40)
+                p += 1 + alen
+            stop = pos + TS_PACKET
+            if not afc & 0x1 or p >= stop:
+                continue
+            if pid == 0:
+                self._parse_pat(buf[p:stop])
+                self.psi[pid] = buf[pos:stop]
+            elif pid in self.pmt_pids:
+                self._parse_pmt(buf[p:stop])
+                self.psi[pid] = buf[pos:stop]
+            elif pid == self.video_pid:
+                payload = buf[p:stop]
+                if not rai and (len(payload) < 9 or
+                                not _is_keyframe_payload(self.video_type, payload[9 + payload[8]:])):
+                    continue
+                pts = self._pes_pts(payload)
+                if pts is not None:
+                    found.append((pts, offset + pos))
+        return found
+
+    def psi_packets(self):
+        # Latest PAT and PMT, so a cut starting at a keyframe is decodable on its own
+        return b"".join(self.psi[pid] for pid in sorted(self.psi))
+
+    def _section(self, data, table_id):
+        if not data:
+            return None
+        data = data[1 + data[0]:]
+        if len(data) < 8 or data[0] != table_id:
+            return None
+        length = ((data[1] & 0x0F) << 8) | data[2]
+        return data[:3 + length - 4]
+
+    def _parse_pat(self, data):
+        sec = self._section(data, 0x00)
+        if sec is None:
+            return
+        for i in range(8, len(sec) - 3, 4):
+            program = (sec[i] << 8) | sec[i + 1]
+            if program:
+                self.pmt_pids.add(((sec[i + 2] & 0x1F) << 8) | sec[i + 3])
+
+    def _parse_pmt(self, data):
+        sec = self._section(data, 0x02)
+        if sec is None or len(sec) < 12:
+            return
+        i = 12 + (((sec[10] & 0x0F) << 8) | sec[11])
+        while i + 5 <= len(sec):
+            stream_type = sec[i]
+            pid = ((sec[i + 1] & 0x1F) << 8) | sec[i + 2]
+            if stream_type in VIDEO_STREAM_TYPES:
+                self.video_pid = pid
+                self.video_type = stream_type
                 return
-            
-            if val.startswith("acestream://"):
-                hashid = val.replace("acestream://", "").strip()
+            i += 5 + (((sec[i + 3] & 0x0F) << 8) | sec[i + 4])
+
+    def _pes_pts(self, p):
+        if len(p) < 14 or p[0:3] != b"\x00\x00\x01" or not p[7] & 0x80:
+            return None
+        raw = (((p[9] >> 1) & 0x07) << 30) | (p[10] << 22) | ((p[11] >> 1) << 15) \
+            | (p[12] << 7) | (p[13] >> 1)
+        # Unwrap the 33-bit clock so long recordings stay monotonic
+        if self.last_raw_pts is not None and raw + PTS_WRAP // 2 < self.last_raw_pts:
+            self.pts_base += PTS_WRAP
+        self.last_raw_pts = raw
+        return self.pts_base + raw
+
+class TsIndex:
+    def __init__(self, entries=None, length=0):
+        self.entries = entries if entries is not None else array("Q")
+        self.length = length
+
+    def __len__(self):
+        return len(self.entries) // 2
+
+    def pts(self, i):
+        return self.entries[2 * i]
+
+    def offset(self, i):
+        return self.entries[2 * i + 1]
+
+    def seek(self, pts):
+        # Last random access point at or before pts
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.pts(mid) <= pts:
+                lo = mid + 1
             else:
-                hashid = val
-            
-            # Update output directory
-            self.output_dir = self.entry_output_dir.get_text()
-            if not os.path.exists(self.output_dir):
-                try:
-                    os.makedirs(self.output_dir, exist_ok=True)
-                except Exception as e:
-                    self.set_status(f"Error creating directory: {e}")
+                hi = mid
+        return max(lo - 1, 0)
+
+    @staticmethod
+    def pack(points):
+        arr = array("Q", [v for point in points for v in point])
+        if sys.byteorder == "big":
+            arr.byteswap()
+        return arr.tobytes()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            magic, version, _, length = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                raise ValueError(f"Not a recording index: {path}")
+            data = f.read()
+        entries = array("Q")
+        # A sidecar cut short by a crash may end in a partial entry
+        entries.frombytes(data[:len(data) - len(data) % 16])
+        if sys.byteorder == "big":
+            entries.byteswap()
+        return cls(entries, length)
+
+class TsIndexer(threading.Thread):
+    CHUNK = 1 << 20
+
+    def __init__(self, ts_path, follow=True, interval=0.5, write_index=True, preview=None):
+        super().__init__(daemon=True)
+        self.ts_path = ts_path
+        self.follow = follow
+        self.interval = interval
+        self.write_index = write_index
+        self.preview = preview
+        self.points = 0
+        self._halt = threading.Event()
+
+    def stop(self, timeout=10):
+        self._halt.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        try:
+            while not os.path.exists(self.ts_path):
+                if not self.follow or self._halt.wait(self.interval):
                     return
-            
-            minutes = int(self.spin_minutes.get_value_as_int())
-            self.set_status("Starting recording: Custom")
-            self._set_ui_sensitive(False)
-            self.stop_flag = False
-            
-            thread = threading.Thread(
-                target=self._record_sequence, 
-                args=([("Custom", hashid)], minutes, self.shutdown_chk.get_active()), 
-                daemon=True
-            )
-            thread.start()
-        
-        def _record_sequence(self, sequence, minutes, shutdown_after):
-            ensure_engine()
-            all_success = True
-            
-            for display_name, hashid in sequence:
-                if self.stop_flag:
-                    all_success = False
+            with open(self.ts_path, "rb") as src:
+                if not self.write_index:
+                    self._scan(src, None)
+                    return
+                with open(index_path(self.ts_path), "wb") as idx:
+                    idx.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, 0))
+                    self._scan(src, idx)
+        except Exception:
+            pass
+        finally:
+            if self.preview is not None:
+                self.preview.close()
+
+    def _scan(self, src, idx):
+        scanner = TsScanner()
+        offset = 0
+        consumed = 0
+        pending = b""
+        while True:
+            data = src.read(self.CHUNK)
+            if not data:
+                # Drain once more after stop so the tail of the file is indexed
+                if not self.follow or self._halt.is_set():
                     break
-                
-                GLib.idle_add(self.set_status, f"Recording: {display_name}")
-                ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-                fname = safe_name(display_name) if display_name else hashid[:12]
-                output_ts = os.path.join(self.output_dir, f"acestream_{fname}_{ts}.ts")
-                
-                ok = self._record_one_proc(hashid, output_ts, minutes)
-                
-                if not ok:
-                    all_success = False
-                else:
-                    # convert
-                    if FFMPEG_BIN:
-                        GLib.idle_add(self.set_status, f"Converting {fname} -> mp4")
-                        mp4_path = os.path.splitext(output_ts)[0] + ".mp4"
-                        try:
-                            conv_cmd = [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", 
-                                       "-i", output_ts, "-c", "copy", mp4_path]
-                            conv_proc = subprocess.run(conv_cmd, stdout=subprocess.PIPE, 
-                                                      stderr=subprocess.PIPE, text=True)
-                            if conv_proc.returncode != 0:
-                                all_success = False
-                        except Exception:
-                            all_success = False
-                
-                time.sleep(0.6)
-            
-            GLib.idle_add(self._set_ui_sensitive, True)
-            
-            if shutdown_after and all_success and not self.stop_flag:
-                GLib.idle_add(self.set_status, "Waiting 30 seconds before shutdown...")
-                for i in range(30, 0, -1):
-                    if self.stop_flag:
-                        GLib.idle_add(self.set_status, "Shutdown cancelled")
-                        return
-                    GLib.idle_add(self.set_status, f"Shutting down in {i} seconds... (stop to cancel)")
-                    time.sleep(1)
-                
+                self._halt.wait(self.interval)
+                if self._halt.is_set():
+                    self.follow = False
+                continue
+            consumed += len(data)
+            buf = pending + data
+            skip = self._resync(buf)
+            offset += skip
+            usable = (len(buf) - skip) // TS_PACKET * TS_PACKET
+            packets = buf[skip:skip + usable]
+            points = scanner.feed(packets, offset)
+            if self.preview is not None:
+                self.preview.feed(packets, offset, points, scanner.psi_packets())
+            offset += usable
+            pending = buf[skip + usable:]
+            if idx is not None:
+                if points:
+                    idx.write(TsIndex.pack(points))
+                    self.points += len(points)
+                idx.flush()
+                # Also after chunks without keyframes, or a recording ending on a
+                # partial GOP would look stale to load_index
+                os.pwrite(idx.fileno(), INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, consumed), 0)
+
+    @staticmethod
+    def _resync(buf):
+        if buf[:1] == bytes([TS_SYNC]):
+            return 0
+        for i in range(min(len(buf), TS_PACKET)):
+            if buf[i] == TS_SYNC and buf[i + TS_PACKET:i + TS_PACKET + 1] in (b"", bytes([TS_SYNC])):
+                return i
+        return 0
+
+def build_index(ts_path):
+    TsIndexer(ts_path, follow=False).run()
+    return TsIndex.load(index_path(ts_path))
+
+def load_index(ts_path):
+    # The sidecar is current when it covers every byte of the recording
+    try:
+        index = TsIndex.load(index_path(ts_path))
+        if index.length == os.path.getsize(ts_path):
+            return index
+    except Exception:
+        pass
+    return build_index(ts_path)
+
+def clip_recording(ts_path, start, end, out_path=None):
+    if end <= start:
+        raise ValueError("Clip end must be after its start")
+    index = load_index(ts_path)
+    if not len(index):
+        raise ValueError(f"No keyframes found in {ts_path}")
+
+    first = index.pts(0)
+    i = index.seek(first + int(start * PTS_CLOCK))
+    end_pts = first + int(end * PTS_CLOCK)
+    j = index.seek(end_pts) + 1
+    begin = index.offset(i)
+    stop = index.offset(j) if j < len(index) else os.path.getsize(ts_path)
+    duration = (end_pts - index.pts(i)) / PTS_CLOCK
+
+    if not out_path:
+        base = os.path.splitext(ts_path)[0]
+        out_path = f"{base}_clip_{int(start)}-{int(end)}.ts"
+
+    # Without PAT/PMT up front ffmpeg drops video until the next PMT, so the
+    # clip would start after its keyframe
+    psi = read_psi(ts_path) if begin else b""
+    with open(ts_path, "rb") as src:
+        src.seek(begin)
+        remaining = stop - begin
+        if FFMPEG_BIN:
+            # Stream copy from the keyframe at or before start, trimmed to the wanted length
+            cmd = [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", "-f", "mpegts",
+                   "-i", "pipe:0", "-t", f"{duration:.3f}", "-c", "copy", out_path]
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL)
+            try:
+                proc.stdin.write(psi)
+                while remaining > 0:
+                    data = src.read(min(TsIndexer.CHUNK, remaining))
+                    if not data:
+                        break
+                    proc.stdin.write(data)
+                    remaining -= len(data)
+            except BrokenPipeError:
+                pass
+            finally:
                 try:
-                    subprocess.Popen(["systemctl", "poweroff"])
-                except Exception:
-                    GLib.idle_add(self.set_status, "Finished (error shutting down)")
-            else:
-                if self.stop_flag:
-                    GLib.idle_add(self.set_status, "Stopped by user")
-                else:
-                    GLib.idle_add(self.set_status, "Finished")
-        
-        def _record_one_proc(self, hashid, output_ts, minutes):
-            cmd = [PLAYER, f"acestream://{hashid}", "--vo=null", "--quiet", f"--stream-record={output_ts}"]
-            
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+            if proc.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed to write {out_path}")
+        else:
+            with open(out_path, "wb") as out:
+                out.write(psi)
+                while remaining > 0:
+                    data = src.read(min(TsIndexer.CHUNK, remaining))
+                    if not data:
+                        break
+                    out.write(data)
+                    remaining -= len(data)
+    return out_path
+
+# ---------------- Live preview ----------------
+# The indexer already reads every new byte of a recording; HlsPreview cuts that
+# stream at keyframes into short segments and keeps the last HLS_WINDOW of them
+# (in memory for the API, optionally on disk for local players).
+def preview_dir(ts_path):
+    return ts_path + ".hls"
+
+class HlsPreview:
+    PLAYLIST = "index.m3u8"
+    MAX_PENDING = 64 << 20
+
+    def __init__(self, ts_path, target=HLS_SEGMENT_SECONDS, window=HLS_WINDOW, write_files=HLS_WRITE_FILES):
+        self.dir = preview_dir(ts_path)
+        self.target = target
+        self.window = window
+        self.write_files = write_files
+        self.segments = deque()
+        self.sequence = 0
+        self.ended = False
+        self._pending = bytearray()
+        self._pending_offset = 0
+        self._start_pts = None
+        self._lock = threading.Lock()
+
+    def feed(self, data, offset, points, psi):
+        # data is the next contiguous run of packets from the file, starting at offset
+        if not self._pending:
+            self._pending_offset = offset
+        self._pending += data
+        for pts, point in points:
+            if self._start_pts is None:
+                del self._pending[:point - self._pending_offset]
+                self._pending_offset = point
+                self._start_pts = pts
+            elif pts - self._start_pts >= self.target * PTS_CLOCK:
+                self._cut(point, (pts - self._start_pts) / PTS_CLOCK, psi)
+                self._start_pts = pts
+        if self._start_pts is None or len(self._pending) > self.MAX_PENDING:
+            # Nothing decodable yet (or no keyframes for far too long): wait for the next one
+            self._pending.clear()
+            self._start_pts = None
+
+    def _cut(self, point, seconds, psi):
+        size = point - self._pending_offset
+        data = psi + bytes(self._pending[:size])
+        del self._pending[:size]
+        self._pending_offset = point
+        with self._lock:
+            seq = self.sequence
+            self.sequence += 1
+            self.segments.append((seq, seconds, data))
+            while len(self.segments) > self.window:
+                self.segments.popleft()
+            playlist = self._playlist()
+        if self.write_files:
             try:
-                proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, 
-                                       preexec_fn=os.setsid)
-            except FileNotFoundError:
-                GLib.idle_add(self.set_status, "Error: player not found")
-                GLib.idle_add(lambda: messagebox_dialog("Error", f"Could not find '{PLAYER}' in PATH"))
-                return False
-            except Exception:
-                return False
-            
-            self.current_proc = proc
+                os.makedirs(self.dir, exist_ok=True)
+                self._write(f"seg{seq}.ts", data)
+                self._write(self.PLAYLIST, playlist.encode("utf-8"))
+                # Leave a couple of expired segments for players still fetching them
+                stale = os.path.join(self.dir, f"seg{seq - self.window - 2}.ts")
+                if os.path.exists(stale):
+                    os.remove(stale)
+            except OSError:
+                self.write_files = False
+
+    def _write(self, name, data):
+        tmp = os.path.join(self.dir, name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(self.dir, name))
+
+    def _playlist(self):
+        durations = [math.ceil(seconds) for _, seconds, _ in self.segments]
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3",
+                 f"#EXT-X-TARGETDURATION:{max(durations + [self.target])}",
+                 f"#EXT-X-MEDIA-SEQUENCE:{self.segments[0][0] if self.segments else 0}"]
+        for seq, seconds, _ in self.segments:
+            lines.append(f"#EXTINF:{seconds:.3f},")
+            lines.append(f"seg{seq}.ts")
+        return "\n".join(lines) + "\n"
+
+    def playlist(self):
+        with self._lock:
+            return self._playlist()
+
+    def segment(self, name):
+        with self._lock:
+            for seq, _, data in self.segments:
+                if name == f"seg{seq}.ts":
+                    return data
+        return None
+
+    def close(self):
+        # The preview only makes sense while recording; the .ts itself is the result
+        with self._lock:
+            self.ended = True
+            self.segments.clear()
+        self._pending = bytearray()
+        if os.path.isdir(self.dir):
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+# ---------------- Archival transcode ----------------
+class ArchiveScheduler:
+    # CPU slots for chunk encoders, shared by all archive jobs. Every running
+    # recording takes one slot away, so ingest never waits for an archive.
+    def __init__(self, slots=None, ingesting=None):
+        self.slots = slots or ARCHIVE_WORKERS or os.cpu_count() or 1
+        self.ingesting = ingesting or (lambda: 0)
+        self.running = 0
+        self.cond = threading.Condition()
+
+    def allowed(self):
+        return max(1, self.slots - self.ingesting())
+
+    def acquire(self, should_stop):
+        with self.cond:
+            while self.running >= self.allowed():
+                # Re-checked periodically as recordings start and end
+                self.cond.wait(1.0)
+                if should_stop():
+                    return False
+            self.running += 1
+            return True
+
+    def release(self):
+        with self.cond:
+            self.running -= 1
+            self.cond.notify_all()
+
+def read_psi(ts_path, limit=4 << 20):
+    # PAT/PMT from the start of a recording, prepended to chunks that start mid-file
+    scanner = TsScanner()
+    with open(ts_path, "rb") as f:
+        buf = f.read(limit)
+    skip = TsIndexer._resync(buf)
+    scanner.feed(buf[skip:], skip)
+    return scanner.psi_packets()
+
+def archive_chunks(ts_path, seconds=ARCHIVE_CHUNK_SECONDS):
+    # -> [(begin, end), ...] byte ranges that each start on a keyframe
+    index = load_index(ts_path)
+    size = os.path.getsize(ts_path)
+    if not len(index):
+        return [(0, size)]
+    bounds = [0]
+    last = index.pts(0)
+    for i in range(1, len(index)):
+        if index.pts(i) - last >= seconds * PTS_CLOCK:
+            bounds.append(index.offset(i))
+            last = index.pts(i)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+def probe_duration(path):
+    if not FFPROBE_BIN:
+        return None
+    try:
+        out = subprocess.run([FFPROBE_BIN, "-v", "error", "-show_entries", "format=duration",
+                              "-of", "default=noprint_wrappers=1:nokey=1", path],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=60)
+        return float(out.stdout.decode().strip())
+    except (ValueError, OSError, subprocess.SubprocessError):
+        return None
+
+def _encode_chunk(ts_path, begin, end, psi, out_path, scheduler, should_stop, log):
+    # -> usage dict, or None if the chunk was not encoded
+    if not scheduler.acquire(should_stop):
+        return None
+    group = ResourceGroup("archive", os.path.basename(out_path))
+    t0 = time.perf_counter()
+    try:
+        cmd = [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", "-threads", "1",
+               "-f", "mpegts", "-i", "pipe:0", "-map", "0:v:0", "-map", "0:a?", "-sn", "-dn"]
+        cmd += ARCHIVE_VIDEO_ARGS + ARCHIVE_AUDIO_ARGS + ["-threads", "1", "-f", "mpegts", out_path]
+        proc = group.popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.PIPE)
+        log.attach(proc.stderr)
+        with open(ts_path, "rb") as src:
+            src.seek(begin)
+            remaining = end - begin
             try:
-                self.current_pg = os.getpgid(proc.pid)
-            except Exception:
-                self.current_pg = None
-            
-            total = minutes * 60
-            start = time.time()
-            
-            while True:
-                if self.stop_flag:
-                    break
-                if proc.poll() is not None:
-                    break
-                if (time.time() - start) >= total:
-                    break
-                time.sleep(0.4)
-            
-            if proc.poll() is None:
+                if begin:
+                    proc.stdin.write(psi)
+                while remaining > 0 and not should_stop():
+                    data = src.read(min(TsIndexer.CHUNK, remaining))
+                    if not data:
+                        break
+                    proc.stdin.write(data)
+                    remaining -= len(data)
+                    group.sample()
+            except BrokenPipeError:
+                pass
+            finally:
                 try:
-                    if self.current_pg is not None:
-                        os.killpg(self.current_pg, signal.SIGTERM)
-                    else:
-                        proc.terminate()
-                    time.sleep(1.2)
-                    if proc.poll() is None:
-                        if self.current_pg is not None:
-                            os.killpg(self.current_pg, signal.SIGKILL)
-                        else:
-                            proc.kill()
-                except Exception:
+                    proc.stdin.close()
+                except BrokenPipeError:
                     pass
-            
-            self.current_proc = None
-            self.current_pg = None
-            
-            if not os.path.exists(output_ts) or os.path.getsize(output_ts) == 0:
-                GLib.idle_add(lambda: messagebox_dialog("Warning", 
-                    f"Output file may be empty or not created:\n{output_ts}"))
-                return False
-            
-            return True
+        while True:
+            if should_stop() and proc.poll() is None:
+                proc.kill()
+            try:
+                proc.wait(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                group.sample()
+        log.join()
+        TRACER.complete("archive_chunk", t0, time.perf_counter(), output=out_path, bytes=end - begin)
+        return group.usage() if proc.returncode == 0 and not should_stop() else None
+    except OSError:
+        return None
+    finally:
+        scheduler.release()
+
+def archive_recording(ts_path, scheduler, should_stop=None, capture=None):
+    # -> (ok, usage, error); writes <recording>.mp4. The output of failed
+    # chunk encoders is handed to capture().
+    from concurrent.futures import ThreadPoolExecutor
+    should_stop = should_stop or (lambda: False)
+    mp4_path = os.path.splitext(ts_path)[0] + ".mp4"
+    work = ts_path + ".archive"
+    started = time.time()
+    usage = {"class": "archive", "isolation": "cgroup" if systemd_scopes_available() else "nice",
+             "wall_seconds": 0, "cpu_seconds": 0, "memory_peak": 0, "io_read": 0, "io_write": 0}
+    if not FFMPEG_BIN:
+        return False, usage, "ffmpeg not found"
+
+    failed = threading.Event()
+
+    def stop():
+        return failed.is_set() or should_stop()
+
+    def encode(item):
+        n, (begin, end) = item
+        log = ChildOutput(f"archive-{n}", size=CHILD_LOG_KEEP)
+        result = _encode_chunk(ts_path, begin, end, psi, chunk_paths[n], scheduler, stop, log)
+        if result is None and not stop():
+            failed.set()
+            if capture is not None:
+                capture(log)
+        return result
+
+    with TRACER.span("archive", output=mp4_path):
+        try:
+            chunks = archive_chunks(ts_path)
+            psi = read_psi(ts_path)
+            os.makedirs(work, exist_ok=True)
+            chunk_paths = [os.path.join(work, f"chunk{n:05d}.ts") for n in range(len(chunks))]
+            with ThreadPoolExecutor(max_workers=scheduler.slots) as pool:
+                results = list(pool.map(encode, enumerate(chunks)))
+            for u in results:
+                if u is not None:
+                    usage["cpu_seconds"] += u["cpu_seconds"]
+                    usage["memory_peak"] = max(usage["memory_peak"], u["memory_peak"])
+                    usage["io_read"] += u["io_read"]
+                    usage["io_write"] += u["io_write"]
+            if should_stop():
+                return False, usage, "Archival transcode stopped"
+            if failed.is_set():
+                return False, usage, "Encoding a chunk failed"
+
+            # Chunks share codec parameters, so the concat demuxer joins them as-is
+            listing = os.path.join(work, "chunks.txt")
+            with open(listing, "w") as f:
+                for path in chunk_paths:
+                    f.write(f"file '{os.path.basename(path)}'\n")
+            partial = mp4_path + ".part"
+            rc = subprocess.call([FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error",
+                                  "-f", "concat", "-safe", "0", "-i", listing, "-c", "copy",
+                                  "-movflags", "+faststart", "-f", "mp4", partial],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if rc != 0:
+                return False, usage, "Joining the archive chunks failed"
+
+            expected, actual = probe_duration(ts_path), probe_duration(partial)
+            if expected is not None and (actual is None or abs(actual - expected) > max(2.0, expected * 0.002)):
+                os.remove(partial)
+                return False, usage, f"Archive is {actual}s long, recording {expected:.1f}s"
+            os.replace(partial, mp4_path)
+            if ARCHIVE_DELETE_SOURCE and expected is not None:
+                for path in (ts_path, index_path(ts_path)):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            return True, usage, None
+        except OSError as e:
+            return False, usage, str(e)
+        finally:
+            usage["wall_seconds"] = round(time.time() - started, 1)
+            usage["cpu_seconds"] = round(usage["cpu_seconds"], 1)
+            shutil.rmtree(work, ignore_errors=True)
+            if os.path.exists(mp4_path + ".part"):
+                os.remove(mp4_path + ".part")
+
+# ---------------- Thumbnails ----------------
+# Only the chosen keyframes are read (found through the index) and decoded. A
+# sheet is stored under the SHA-1 of exactly those bytes, so a recording that
+# was moved or copied reuses it; a small ref file per (path, size, mtime) finds
+# it again later without reading the recording at all.
+def thumbnail_ranges(ts_path, count, frame_bytes=1 << 20):
+    # -> [(begin, end), ...] holding one keyframe each, spread over the recording
+    index = load_index(ts_path)
+    n = len(index)
+    if not n:
+        return []
+    size = os.path.getsize(ts_path)
+    ranges = []
+    for i in sorted({int(n * (k + 0.5) / count) for k in range(count)}):
+        begin = index.offset(i)
+        end = index.offset(i + 1) if i + 1 < n else size
+        ranges.append((begin, min(end, begin + frame_bytes)))
+    return ranges
+
+def probe_channel(hashid, timeout=20, limit=8 << 20, frame_bytes=1 << 20):
+    # -> PSI + the first keyframe of a live channel, or None
+    import urllib.request
+    start_engine()
+    if not wait_for_engine():
+        return None
+    url = f"{ENGINE_API}/ace/getstream?id={hashid}&pid={uuid.uuid4().hex}"
+    scanner = TsScanner()
+    buf = bytearray()
+    scanned = 0
+    keyframes = []
+    deadline = time.time() + timeout
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            while time.time() < deadline and len(buf) < limit:
+                data = response.read1(64 * 1024)
+                if not data:
+                    break
+                buf += data
+                if not scanned:
+                    pos = find_ts_start(buf)
+                    if pos < 0:
+                        continue
+                    del buf[:pos]
+                end = len(buf) - len(buf) % TS_PACKET
+                keyframes += [offset for _, offset in scanner.feed(bytes(buf[scanned:end]), scanned)]
+                scanned = end
+                if len(keyframes) > 1 or (keyframes and scanned - keyframes[0] >= frame_bytes):
+                    break
+    except Exception:
+        return None
+    if not keyframes:
+        return None
+    begin = keyframes[0]
+    end = min(keyframes[1] if len(keyframes) > 1 else scanned, begin + frame_bytes)
+    return scanner.psi_packets() + bytes(buf[begin:end])
+
+def render_contact_sheet(data, frames, width):
+    # data: PSI + keyframes -> PNG with the frames side by side, or None
+    if not FFMPEG_BIN:
+        return None
+    group = ResourceGroup("thumbnail")
+    cmd = [FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-threads", "1",
+           "-skip_frame", "nokey", "-f", "mpegts", "-i", "pipe:0", "-map", "0:v:0",
+           "-vf", f"scale={width}:-2,tile={frames}x1", "-frames:v", "1",
+           "-c:v", "png", "-f", "image2pipe", "pipe:1"]
+    try:
+        proc = group.popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                           stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    try:
+        out, _ = proc.communicate(data, timeout=120)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        return None
+    return out if proc.returncode == 0 and out else None
+
+class ThumbnailCache:
+    # Content-addressed files; a file's mtime is its last use
+    def __init__(self, root=THUMBNAIL_DIR, limit=THUMBNAIL_CACHE_BYTES):
+        self.root = root
+        self.limit = limit
+        self.total = None
+        self.lock = threading.Lock()
+
+    def _path(self, name, suffix):
+        return os.path.join(self.root, name[:2], name + suffix)
+
+    def get(self, key):
+        path = self._path(key, ".png")
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, data):
+        path = self._path(key, ".png")
+        self._write(path, data)
+        return path
+
+    def ref(self, name):
+        # -> content key last stored under name, or None
+        path = self._path(name, ".ref")
+        try:
+            with open(path, encoding="ascii") as f:
+                key = f.read().strip()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return key or None
+
+    def set_ref(self, name, key):
+        self._write(self._path(name, ".ref"), key.encode("ascii"))
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            if self.total is None:
+                self.total = sum(size for _, size, _ in self._files())
+            else:
+                self.total += len(data)
+            if self.total > self.limit:
+                self._evict(self.limit * 9 // 10)
+
+    def _files(self):
+        out = []
+        try:
+            subdirs = os.listdir(self.root)
+        except OSError:
+            return out
+        for sub in subdirs:
+            sub = os.path.join(self.root, sub)
+            try:
+                names = os.listdir(sub)
+            except OSError:
+                continue
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(sub, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                out.append((st.st_mtime, st.st_size, path))
+        return out
+
+    def _evict(self, target):
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self.total = total
+
+class ThumbnailService:
+    # Sheets are made on a few low-priority threads. Newest requests go first
+    # and the oldest are dropped beyond QUEUE, so rows scrolled out of view make
+    # way for the visible ones (which simply ask again when they come back).
+    # Sources are ("file", path.ts) or ("channel", hash).
+    QUEUE = 64
+
+    def __init__(self, cache=None, workers=THUMBNAIL_WORKERS):
+        self.cache = cache or ThumbnailCache()
+        self.workers = workers
+        self.threads = []
+        self.pending = deque()
+        self.running = set()
+        self.waiting = {}
+        self.cond = threading.Condition()
+
+    def _ref_name(self, source, count, width):
+        import hashlib
+        kind, value = source
+        if kind == "file":
+            st = os.stat(value)
+            ident = f"{os.path.abspath(value)}\0{st.st_size}\0{st.st_mtime_ns}"
+        else:
+            ident = f"{value}\0{int(time.time() // THUMBNAIL_LIVE_TTL)}"
+        return hashlib.sha1(f"{kind}\0{ident}\0{count}x{width}".encode("utf-8")).hexdigest()
+
+    def lookup(self, source, count=THUMBNAIL_COUNT, width=THUMBNAIL_WIDTH):
+        # Cached sheet of source as it is now, without reading it
+        try:
+            key = self.cache.ref(self._ref_name(source, count, width))
+        except OSError:
+            return None
+        return self.cache.get(key) if key else None
+
+    def request(self, source, callback=None, count=THUMBNAIL_COUNT, width=THUMBNAIL_WIDTH):
+        # -> cached path, or None with the sheet queued; callback(path or None)
+        # then runs on a worker thread
+        path = self.lookup(source, count, width)
+        if path is not None:
+            return path
+        item = (source, count, width)
+        with self.cond:
+            callbacks = self.waiting.get(item)
+            if callbacks is None:
+                callbacks = self.waiting[item] = []
+            if callback is not None:
+                callbacks.append(callback)
+            # Being made already: the callback above is all it takes
+            if item in self.running:
+                return None
+            if item in self.pending:
+                self.pending.remove(item)
+            self.pending.appendleft(item)
+            while len(self.pending) > self.QUEUE:
+                self.waiting.pop(self.pending.pop(), None)
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True, name="thumbnails")
+                self.threads.append(thread)
+                thread.start()
+            self.cond.notify()
+        return None
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                item = self.pending.popleft()
+                self.running.add(item)
+            try:
+                path = self.generate(*item)
+            except Exception:
+                path = None
+            with self.cond:
+                self.running.discard(item)
+                callbacks = self.waiting.pop(item, [])
+            for callback in callbacks:
+                try:
+                    callback(path)
+                except Exception:
+                    pass
+
+    def generate(self, source, count=THUMBNAIL_COUNT, width=THUMBNAIL_WIDTH):
+        # -> path of the sheet, or None if source has no usable video
+        import hashlib
+        name = self._ref_name(source, count, width)
+        kind, value = source
+        with TRACER.span("thumbnail", source=value):
+            if kind == "file":
+                ranges = thumbnail_ranges(value, count)
+                data = bytearray(read_psi(value))
+                with open(value, "rb") as f:
+                    for begin, end in ranges:
+                        f.seek(begin)
+                        data += f.read(end - begin)
+                frames = len(ranges)
+            else:
+                data = probe_channel(value)
+                frames = 1 if data else 0
+            if not frames:
+                return None
+            key = hashlib.sha1(f"{width}\0".encode("ascii") + bytes(data)).hexdigest()
+            path = self.cache.get(key)
+            if path is None:
+                png = render_contact_sheet(bytes(data), frames, width)
+                if png is None:
+                    return None
+                path = self.cache.put(key, png)
+            self.cache.set_ref(name, key)
+            return path
+
+THUMBS = ThumbnailService()
+
+def channel_thumbnail_source(hashid, manager=None):
+    # The channel's newest recording, else (if enabled) a live probe
+    ts = (manager or JOBS).catalog.latest_files().get(hashid)
+    if ts and os.path.exists(ts):
+        return ("file", ts)
+    return ("channel", hashid) if THUMBNAIL_LIVE else None
+
+# ---------------- Channel list ----------------
+def read_channels(path=CHANNELS_FILE):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if not isinstance(data, list):
+        raise ValueError("JSON is not a list")
+
+    # Rows are keyed by hash, so entries without one (or repeating one) are dropped
+    links = []
+    seen = set()
+    for item in data:
+        channel = item.get("channel", "")
+        link = item.get("link", "")
+        hash_id = link.replace("acestream://", "").strip() if link else ""
+        if not hash_id or hash_id in seen:
+            continue
+        seen.add(hash_id)
+        links.append({
+            "channel": channel,
+            "link": hash_id,
+            "work": True  # Assume all channels work
+        })
+    return links
+
+def diff_channels(old, new):
+    # -> (removed, inserted, renamed) lists of hashes
+    old_names = {item["link"]: item["channel"] for item in old}
+    new_names = {item["link"]: item["channel"] for item in new}
+    removed = [h for h in old_names if h not in new_names]
+    inserted = [h for h in new_names if h not in old_names]
+    renamed = [h for h, name in new_names.items() if h in old_names and old_names[h] != name]
+    return removed, inserted, renamed
+
+def channel_matches(item, filter_text):
+    ft = (filter_text or "").strip().lower()
+    return not ft or ft in item.get("channel", "").lower() or ft in item.get("link", "").lower()
+
+class ChannelFileWatcher(threading.Thread):
+    # Calls callback() after the channel file is rewritten. Watches the parent
+    # directory so editors and scrapers that replace the file by rename are seen.
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, path, callback, interval=2.0, debounce=0.3):
+        super().__init__(daemon=True)
+        self.path = path
+        self.callback = callback
+        self.interval = interval
+        self.debounce = debounce
+        self._halt = threading.Event()
+
+    def stop(self):
+        self._halt.set()
+
+    def run(self):
+        fd = self._inotify_open()
+        if fd is None:
+            self._poll()
+            return
+        try:
+            self._watch(fd)
+        finally:
+            os.close(fd)
+
+    def _inotify_open(self):
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            directory = os.path.dirname(os.path.abspath(self.path))
+            if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except Exception:
+            return None
+
+    def _drain(self, fd):
+        name = os.fsencode(os.path.basename(self.path))
+        hit = False
+        while True:
+            try:
+                data = os.read(fd, 4096)
+            except BlockingIOError:
+                return hit
+            pos = 0
+            while pos + self.EVENT.size <= len(data):
+                _, _, _, length = self.EVENT.unpack_from(data, pos)
+                start = pos + self.EVENT.size
+                if data[start:start + length].rstrip(b"\0") == name:
+                    hit = True
+                pos = start + length
+
+    def _watch(self, fd):
+        while not self._halt.is_set():
+            ready, _, _ = select.select([fd], [], [], 1.0)
+            if not ready or not self._drain(fd):
+                continue
+            # Coalesce bursts of writes into a single reload
+            while select.select([fd], [], [], self.debounce)[0]:
+                self._drain(fd)
+            self.callback()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError:
+            return None
+
+    def _poll(self):
+        last = self._stat()
+        while not self._halt.wait(self.interval):
+            current = self._stat()
+            if current != last:
+                last = current
+                if current is not None:
+                    self.callback()
+
+def load_channels(path=CHANNELS_FILE):
+    # read_channels() that also refreshes the snapshot for the next start
+    links = read_channels(path)
+    save_channel_snapshot(links, path)
+    return links
+
+def load_channel_snapshot(source=CHANNELS_FILE, path=CHANNEL_SNAPSHOT):
+    # -> (links or None, fresh); fresh means channels.json has not changed since
+    try:
+        st = os.stat(source)
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        if snapshot["source"] != os.path.abspath(source):
+            return None, False
+        return snapshot["links"], snapshot["key"] == [st.st_size, st.st_mtime_ns]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, False
+
+def save_channel_snapshot(links, source=CHANNELS_FILE, path=CHANNEL_SNAPSHOT):
+    try:
+        st = os.stat(source)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"source": os.path.abspath(source), "key": [st.st_size, st.st_mtime_ns],
+                       "links": links}, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+_channel_cache = (None, [])
+
+def cached_channels(path=CHANNELS_FILE):
+    # Re-parse only when the file changed, so API polling stays cheap
+    global _channel_cache
+    st = os.stat(path)
+    key = (path, st.st_ino, st.st_size, st.st_mtime_ns)
+    if _channel_cache[0] != key:
+        _channel_cache = (key, read_channels(path))
+    return _channel_cache[1]
+
+# ---------------- Output volumes ----------------
+def _copy_range(fin, fout, offset, count):
+    # copy_file_range keeps the data in the kernel (and reflinks where the
+    # filesystem can); older kernels refuse it across filesystems
+    if hasattr(os, "copy_file_range"):
+        try:
+            return os.copy_file_range(fin, fout, count, offset, offset)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    return os.pwrite(fout, os.pread(fin, count, offset), offset)
+
+def copy_file(src, dst, limit_bps=None):
+    partial = dst + ".part"
+    with open(src, "rb") as fin, open(partial, "wb") as fout:
+        size = os.fstat(fin.fileno()).st_size
+        copied = 0
+        started = time.time()
+        while copied < size:
+            n = _copy_range(fin.fileno(), fout.fileno(), copied, min(8 << 20, size - copied))
+            if n <= 0:
+                break
+            copied += n
+            if limit_bps:
+                ahead = copied / limit_bps - (time.time() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        os.fsync(fout.fileno())
+    if copied != size:
+        os.remove(partial)
+        raise OSError(f"Short copy of {src}")
+    shutil.copystat(src, partial)
+    os.replace(partial, dst)
+
+def move_file(src, dst, limit_bps=None):
+    try:
+        os.rename(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    copy_file(src, dst, limit_bps)
+    os.remove(src)
+
+class Volume:
+    PROBE_BYTES = 1 << 20
+    _probe_data = None
+
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.latency = None
+        self.probed = None
+
+    def holds(self, path):
+        return os.path.abspath(path).startswith(self.path + os.sep)
+
+    def free(self):
+        return disk_free(self.path)
+
+    def used_fraction(self):
+        try:
+            usage = shutil.disk_usage(self.path)
+        except OSError:
+            return 1.0
+        return 1.0 - usage.free / usage.total if usage.total else 1.0
+
+    def usage(self):
+        # -> (used, total) bytes as rebalancing sees them
+        usage = shutil.disk_usage(self.path)
+        return usage.total - usage.free, usage.total
+
+    def probe(self):
+        # Synchronous 1 MiB write; latency is an EWMA of its duration
+        if Volume._probe_data is None:
+            Volume._probe_data = os.urandom(self.PROBE_BYTES)
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, ".acestream-probe")
+        t0 = time.perf_counter()
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.write(fd, Volume._probe_data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+            os.remove(path)
+        seconds = time.perf_counter() - t0
+        self.latency = seconds if self.latency is None else 0.7 * self.latency + 0.3 * seconds
+        self.probed = time.time()
+
+class VolumeSet:
+    def __init__(self, paths):
+        self.volumes = []
+        for path in paths:
+            volume = Volume(path)
+            if all(v.path != volume.path for v in self.volumes):
+                self.volumes.append(volume)
+
+    def __len__(self):
+        return len(self.volumes)
+
+    def allows(self, directory):
+        # directory is a volume or below one, with symlinks and ".." resolved
+        real = os.path.realpath(os.path.expanduser(directory))
+        for volume in self.volumes:
+            root = os.path.realpath(volume.path)
+            if real == root or real.startswith(root + os.sep):
+                return True
+        return False
+
+    def find(self, path):
+        holders = [v for v in self.volumes if v.holds(path)]
+        return max(holders, key=lambda v: len(v.path)) if holders else None
+
+    def choose(self, need, active):
+        # active: {volume path: recordings running there}
+        free = {v.path: v.free() for v in self.volumes}
+        fits = [v for v in self.volumes if free[v.path] >= need + VOLUME_MIN_FREE]
+
+        def score(v):
+            n = active.get(v.path, 0)
+            return ((n + 1) * (v.latency or 0), n, -free[v.path])
+
+        return min(fits, key=score) if fits else max(self.volumes, key=lambda v: free[v.path])
+
+class VolumeMonitor(threading.Thread):
+    def __init__(self, manager, interval=VOLUME_PROBE_INTERVAL):
+        super().__init__(daemon=True, name="volumes")
+        self.manager = manager
+        self.interval = interval
+        self._halt = threading.Event()
+
+    def stop(self):
+        self._halt.set()
+
+    def run(self):
+        wait = 0
+        while not self._halt.wait(wait):
+            wait = self.interval
+            for volume in self.manager.volumes.volumes:
+                try:
+                    volume.probe()
+                except OSError:
+                    volume.latency = None
+            if REBALANCE:
+                try:
+                    self.manager.rebalance()
+                except OSError:
+                    pass
+
+# ---------------- Jobs ----------------
+# One Job per recording. JobManager runs them (on their own thread or on the
+# caller's), tracks their state and notifies subscribers of every transition:
+# queued -> starting -> recording -> converting | archiving -> finished | stopped | failed
+class CapacityError(Exception):
+    pass
+
+class Catalog:
+    # Append-only JSON lines list of finished recordings
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._latest = None
+
+    def add(self, entry):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def entries(self, since=0):
+        out = []
+        with self.lock:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue
+                        # Entries of moved files are appended again with "updated"
+                        if max(entry.get("finished") or 0, entry.get("updated") or 0) > since:
+                            out.append(entry)
+            except FileNotFoundError:
+                pass
+        return out
+
+    def latest_files(self, suffix=".ts"):
+        # hash -> newest listed file ending in suffix; re-read only on change
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return {}
+        stamp = (st.st_size, st.st_mtime_ns)
+        if self._latest is None or self._latest[0] != stamp:
+            latest = {}
+            for entry in self.entries():
+                for f in entry.get("files", []):
+                    if f.get("path", "").endswith(suffix):
+                        latest[entry.get("hash")] = f["path"]
+            self._latest = (stamp, latest)
+        return self._latest[1]
+
+class Job:
+    def __init__(self, hashid, name="", minutes=60, output_dir=None, convert=True, archive=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.hash = hashid
+        self.name = name or hashid[:12]
+        self.minutes = minutes
+        self.output_dir = output_dir or OUTPUT_DIR
+        ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        fname = safe_name(name) if name else hashid[:12]
+        # The id keeps two recordings of a channel started in the same second apart
+        self.output_ts = os.path.join(self.output_dir, f"acestream_{fname}_{ts}_{self.id[:6]}.ts")
+        self.convert = convert
+        self.archive = ARCHIVE if archive is None else archive
+        self.state = "queued"
+        self.error = None
+        self.mode = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.ttfb = None
+        self.usage = []
+        self.proc = None
+        self.fast = None
+        self.preview = None
+        self.metrics = {}
+        self.logs = []
+        self.on_metrics = None
+        self._metrics_published = 0
+        self.stop_event = threading.Event()
+
+    def should_stop(self):
+        return self.stop_event.is_set()
+
+    def capture(self, label):
+        # A ChildOutput whose parsed values feed this job's metrics
+        log = ChildOutput(label, on_metrics=self._update_metrics)
+        self.logs.append(log)
+        return log
+
+    def keep_log(self, log):
+        self.logs.append(log)
+
+    def _update_metrics(self, updates):
+        self.metrics.update(updates)
+        # At most one event per second, errors always
+        now = time.time()
+        if self.on_metrics is not None and (now - self._metrics_published >= 1 or "errors" in updates):
+            self._metrics_published = now
+            self.on_metrics(self)
+
+    def save_logs(self, keep=CHILD_LOG_KEEP):
+        # Last bytes of every child's output next to the recording; -> path or None
+        logs = [log for log in self.logs if log.total]
+        if not logs:
+            return None
+        path = os.path.splitext(self.output_ts)[0] + ".stderr.log"
+        try:
+            with open(path, "wb") as f:
+                for log in logs:
+                    f.write(f"==> {log.label} (last {min(keep, log.total)} of {log.total} bytes) <==\n"
+                            .encode("utf-8"))
+                    f.write(log.tail(keep))
+                    f.write(b"\n")
+        except OSError:
+            return None
+        return path
+
+    def stop(self):
+        # Only signals; the job thread does the TERM/KILL escalation
+        self.stop_event.set()
+        fast = self.fast
+        if fast is not None:
+            fast.stop()
+        proc = self.proc
+        if proc is not None and proc.poll() is None:
+            try:
+                os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
+            except Exception:
+                proc.terminate()
+
+    def throughput(self):
+        # Average ingest rate in bytes/s since the first byte
+        if self.ttfb is None or not self.started:
+            return 0
+        elapsed = (self.finished or time.time()) - self.started - self.ttfb
+        try:
+            return os.path.getsize(self.output_ts) / elapsed if elapsed > 0 else 0
+        except OSError:
+            return 0
+
+    def summary(self):
+        parts = []
+        if self.ttfb is not None:
+            parts.append(f"first byte after {self.ttfb:.1f}s")
+        parts.extend(format_usage(u) for u in self.usage)
+        if self.metrics.get("last_error") and self.state == "failed":
+            parts.append(f"last error: {self.metrics['last_error']}")
+        return parts
+
+    def snapshot(self):
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+        try:
+            size = os.path.getsize(self.output_ts)
+        except OSError:
+            size = 0
+        return {
+            "id": self.id,
+            "hash": self.hash,
+            "name": self.name,
+            "state": self.state,
+            "mode": self.mode,
+            "minutes": self.minutes,
+            "output": self.output_ts,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed": round(elapsed, 1),
+            "progress": round(min(elapsed / (self.minutes * 60), 1.0), 4) if self.minutes else 0,
+            "bytes": size,
+            "ttfb": self.ttfb,
+            "usage": self.usage,
+            "preview": (f"/jobs/{self.id}/preview/{HlsPreview.PLAYLIST}"
+                        if self.preview is not None and not self.preview.ended else None),
+            "metrics": dict(self.metrics),
+            "error": self.error,
+        }
+
+class JobManager:
+    DONE = ("finished", "stopped", "failed")
+    # Archiving jobs no longer hold a recording slot
+    BACKGROUND = ("archiving",)
+    INGEST = ("starting", "recording")
+    KEEP_FINISHED = 200
+
+    def __init__(self, output_dir=None, max_jobs=None, volumes=None):
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.output_dir = output_dir or OUTPUT_DIR
+        self.max_jobs = max_jobs
+        self.volumes = VolumeSet([self.output_dir] + list(OUTPUT_VOLUMES if volumes is None else volumes))
+        self.catalog = Catalog(os.path.join(self.output_dir, CATALOG_NAME))
+        self.archiver = ArchiveScheduler(ingesting=self.ingesting)
+
+    def subscribe(self, fn):
+        with self.lock:
+            self.listeners.append(fn)
+
+    def unsubscribe(self, fn):
+        with self.lock:
+            if fn in self.listeners:
+                self.listeners.remove(fn)
+
+    def publish(self, event, job):
+        snap = job.snapshot()
+        with self.lock:
+            listeners = list(self.listeners)
+        for fn in listeners:
+            try:
+                fn(event, snap)
+            except Exception:
+                pass
+
+    def set_state(self, job, state, error=None):
+        job.state = state
+        if error:
+            job.error = error
+        self.publish(state, job)
+
+    def add(self, job):
+        with self.lock:
+            self.jobs[job.id] = job
+            done = [j for j in self.jobs.values() if j.state in self.DONE]
+            for old in done[:max(0, len(done) - self.KEEP_FINISHED)]:
+                del self.jobs[old.id]
+        self.publish("queued", job)
+        return job
+
+    def submit(self, hashid, name="", minutes=60, output_dir=None):
+        if self.max_jobs is not None and self.active() >= self.max_jobs:
+            raise CapacityError(f"All {self.max_jobs} recording slots are busy")
+        job = self.add(Job(hashid, name, minutes, self.place(output_dir, minutes)))
+        threading.Thread(target=self.run, args=(job,), daemon=True, name=f"job-{job.id}").start()
+        return job
+
+    def place(self, output_dir=None, minutes=60):
+        # Spread recordings over the volumes unless another directory was chosen
+        default = self.volumes.volumes[0].path
+        if output_dir and os.path.abspath(os.path.expanduser(output_dir)) != default:
+            return output_dir
+        if len(self.volumes) < 2:
+            return self.output_dir
+        active = {}
+        with self.lock:
+            running = [j for j in self.jobs.values() if j.state not in self.DONE]
+        for job in running:
+            volume = self.volumes.find(job.output_ts)
+            if volume is not None:
+                active[volume.path] = active.get(volume.path, 0) + 1
+        return self.volumes.choose(minutes * 60 * PREALLOCATE_MBPS * 125000, active).path
+
+    def rebalance(self, threshold=REBALANCE_THRESHOLD, exclude=()):
+        # Move the oldest finished recording from the fullest volume to the
+        # emptiest one; returns its updated catalog entry, or None
+        if len(self.volumes) < 2:
+            return None
+        by_use = sorted(self.volumes.volumes, key=lambda v: v.used_fraction())
+        target, source = by_use[0], by_use[-1]
+        if source.used_fraction() - target.used_fraction() < threshold:
+            return None
+        # Only files that fit in the bytes that would equalise the two used
+        # fractions, so a move never tips the balance the other way (and the
+        # same recording back again)
+        (src_used, src_total), (dst_used, dst_total) = source.usage(), target.usage()
+        room = (src_used * dst_total - dst_used * src_total) / (src_total + dst_total)
+        with self.lock:
+            busy = {j.output_ts for j in self.jobs.values() if j.state not in self.DONE}
+        latest = {}
+        for entry in self.catalog.entries():
+            latest[entry.get("job")] = entry
+        for entry in sorted(latest.values(), key=lambda e: e.get("finished") or 0):
+            if entry.get("job") in exclude:
+                continue
+            files = [f for f in entry.get("files", []) if os.path.exists(f["path"])]
+            if not files or any(f["path"] in busy or not source.holds(f["path"]) for f in files):
+                continue
+            if sum(os.path.getsize(f["path"]) for f in files) > room:
+                continue
+            moved = []
+            for f in files:
+                dst = os.path.join(target.path, os.path.relpath(f["path"], source.path))
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                move_file(f["path"], dst, REBALANCE_MBPS * 125000)
+                if os.path.exists(index_path(f["path"])):
+                    move_file(index_path(f["path"]), index_path(dst))
+                moved.append(dict(f, path=dst, volume=target.path))
+            entry = dict(entry, files=moved, volume=target.path, updated=time.time())
+            self.catalog.add(entry)
+            return entry
+        return None
+
+    def find(self, key):
+        # By job id, else the newest job for that hash (running ones first)
+        with self.lock:
+            if key in self.jobs:
+                return self.jobs[key]
+            matches = [j for j in self.jobs.values() if j.hash == key]
+        running = [j for j in matches if j.state not in self.DONE]
+        return (running or matches or [None])[-1]
+
+    def stop(self, key):
+        job = self.find(key)
+        if job is not None:
+            job.stop()
+        return job
+
+    def list(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [j.snapshot() for j in jobs]
+
+    def active(self):
+        with self.lock:
+            return sum(1 for j in self.jobs.values() if j.state not in self.DONE + self.BACKGROUND)
+
+    def ingesting(self):
+        with self.lock:
+            return sum(1 for j in self.jobs.values() if j.state in self.INGEST)
+
+    def capacity(self):
+        with self.lock:
+            running = [j for j in self.jobs.values() if j.state not in self.DONE + self.BACKGROUND]
+        return {
+            "host": socket.gethostname(),
+            "max_jobs": self.max_jobs,
+            "active": len(running),
+            "slots": None if self.max_jobs is None else max(0, self.max_jobs - len(running)),
+            "ingest_bps": round(sum(j.throughput() for j in running)),
+            "bandwidth_bps": WORKER_BANDWIDTH_MBPS * 125000 if WORKER_BANDWIDTH_MBPS else None,
+            "disk_free": max(v.free() for v in self.volumes.volumes),
+            "volumes": [self._volume_stats(v, running) for v in self.volumes.volumes],
+            "load": os.getloadavg()[0],
+            "cpus": os.cpu_count(),
+        }
+
+    @staticmethod
+    def _volume_stats(volume, running):
+        jobs = [j for j in running if volume.holds(j.output_ts)]
+        return {
+            "path": volume.path,
+            "free": volume.free(),
+            "active": len(jobs),
+            "write_bps": round(sum(j.throughput() for j in jobs)),
+            "latency_ms": round(volume.latency * 1000, 1) if volume.latency is not None else None,
+        }
+
+    def catalog_entries(self, since=0):
+        return self.catalog.entries(since)
+
+    def _record_catalog(self, job):
+        files = []
+        for path in (job.output_ts, os.path.splitext(job.output_ts)[0] + ".mp4"):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            volume = self.volumes.find(path)
+            files.append({"path": path, "bytes": size,
+                          "volume": volume.path if volume else os.path.dirname(path)})
+        if not files:
+            return
+        try:
+            self.catalog.add({
+                "job": job.id, "hash": job.hash, "name": job.name, "state": job.state,
+                "started": job.started, "finished": job.finished,
+                "host": socket.gethostname(), "volume": files[0]["volume"], "files": files,
+            })
+        except OSError:
+            pass
+
+    @TRACER.profiled
+    def run(self, job):
+        job.on_metrics = lambda j: self.publish("metrics", j)
+        job.started = time.time()
+        self.set_state(job, "starting")
+        TRACER.instant("job_start", channel=job.name, hash=job.hash, output=job.output_ts)
+        t0 = time.perf_counter()
+
+        try:
+            os.makedirs(job.output_dir, exist_ok=True)
+            ok = self._record_fast(job) if FAST_START else None
+            if ok is None:
+                if not FAST_START:
+                    with TRACER.span("ensure_engine"):
+                        ensure_engine()
+                ok = self._record_player(job, t0)
+        except Exception as e:
+            ok = False
+            job.error = job.error or str(e)
+
+        if not os.path.exists(job.output_ts) or os.path.getsize(job.output_ts) == 0:
+            state = "failed"
+            job.error = job.error or f"Output file may be empty or not created:\n{job.output_ts}"
+        else:
+            state = "stopped" if job.should_stop() else "finished"
+            archived = False
+            if job.archive and FFMPEG_BIN and state == "finished":
+                self.set_state(job, "archiving")
+                archived, arch_usage, arch_error = archive_recording(
+                    job.output_ts, self.archiver, job.should_stop, job.keep_log)
+                job.usage.append(arch_usage)
+                if not archived:
+                    # Still leave a playable mp4 behind
+                    job.error = f"Archival transcode failed ({arch_error}); kept a stream copy"
+            if job.convert and FFMPEG_BIN and not archived:
+                self.set_state(job, "converting")
+                conv_ok, conv_usage = convert_to_mp4(job.output_ts, job.capture("conversion"))
+                job.usage.append(conv_usage)
+                if not conv_ok:
+                    state = "failed"
+                    job.error = "Conversion to mp4 failed"
+
+        if state == "failed" or job.error:
+            log_path = job.save_logs()
+            if log_path:
+                job.error = f"{job.error or 'Failed'} (details in {log_path})"
+        # Only the parsed metrics outlive the job's run
+        job.logs = []
+        job.on_metrics = None
+
+        job.finished = time.time()
+        TRACER.memory_snapshot(job.name)
+        TRACER.save()
+        job.state = state
+        self._record_catalog(job)
+        self.set_state(job, state)
+        return job
+
+    def _tailer(self, job):
+        # One reader follows the growing file for both the index and the preview
+        job.preview = HlsPreview(job.output_ts) if LIVE_PREVIEW else None
+        if not WRITE_INDEX and job.preview is None:
+            return None
+        return TsIndexer(job.output_ts, write_index=WRITE_INDEX, preview=job.preview)
+
+    def _record_fast(self, job):
+        rec = FastStartRecording(job.hash, job.output_ts, job.minutes)
+        indexer = self._tailer(job)
+
+        def on_first_byte(ttfb):
+            # Index only once data flows; a fallback to the player replaces the file
+            if indexer:
+                indexer.start()
+            job.ttfb = ttfb
+            job.mode = "engine"
+            self.set_state(job, "recording")
+
+        rec.on_first_byte = on_first_byte
+        rec.on_stats = job._update_metrics
+        job.fast = rec
+        ok = rec.run(job.should_stop)
+        job.fast = None
+        if ok is not None:
+            job.usage.append(rec.usage())
+
+        if indexer and indexer.is_alive():
+            with TRACER.span("index_flush", points=indexer.points):
+                indexer.stop()
+        elif job.preview is not None:
+            job.preview.close()
+        return ok
+
+    def _record_player(self, job, t0):
+        hashid, output_ts = job.hash, job.output_ts
+        cmd = [PLAYER, f"acestream://{hashid}", "--vo=null", "--quiet", f"--stream-record={output_ts}"]
+
+        group = ResourceGroup("ingest", hashid[:12])
+        spawn_start = time.perf_counter()
+        try:
+            proc = group.popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+        except FileNotFoundError:
+            job.error = f"Could not find '{PLAYER}' in PATH"
+            return False
+        job.capture("player").attach(proc.stdout)
+
+        job.proc = proc
+        job.mode = "player"
+        try:
+            pg = os.getpgid(proc.pid)
+        except Exception:
+            pg = None
+
+        spawned = time.perf_counter()
+        TRACER.complete("player_spawn", spawn_start, spawned, hash=hashid)
+
+        indexer = self._tailer(job)
+        if indexer:
+            indexer.start()
+
+        total = job.minutes * 60
+        start = time.time()
+        first_byte = None
+
+        while True:
+            if job.should_stop():
+                break
+            if proc.poll() is not None:
+                break
+            if (time.time() - start) >= total:
+                break
+            if first_byte is None and os.path.exists(output_ts) and os.path.getsize(output_ts) > 0:
+                first_byte = time.perf_counter()
+                job.ttfb = first_byte - t0
+                TRACER.complete("engine_buffering", spawned, first_byte, hash=hashid)
+                self.set_state(job, "recording")
+            group.sample()
+            time.sleep(0.4)
+
+        TRACER.complete("recording", first_byte or spawned, time.perf_counter(), hash=hashid)
+        job.usage.append(group.usage())
+
+        teardown_start = time.perf_counter()
+        if proc.poll() is None:
+            try:
+                if pg is not None:
+                    os.killpg(pg, signal.SIGTERM)
+                else:
+                    proc.terminate()
+                time.sleep(1.2)
+                if proc.poll() is None:
+                    if pg is not None:
+                        os.killpg(pg, signal.SIGKILL)
+                    else:
+                        proc.kill()
+            except Exception:
+                pass
+
+        job.proc = None
+        TRACER.complete("teardown", teardown_start, time.perf_counter(), hash=hashid)
+
+        if indexer:
+            with TRACER.span("index_flush", points=indexer.points):
+                indexer.stop()
+        return True
+
+JOBS = JobManager()
+
+def describe_job_event(event, job):
+    # Status bar text for a job transition
+    name = job["name"]
+    if event == "starting":
+        return f"Starting recording: {name}"
+    if event == "recording":
+        if job["ttfb"] is not None:
+            return f"Recording: {name} (first byte after {job['ttfb']:.1f}s)"
+        return f"Recording: {name}"
+    if event == "converting":
+        return f"Converting {name} -> mp4"
+    if event == "archiving":
+        return f"Archiving {name} (re-encoding in parallel chunks)"
+    if event == "metrics":
+        details = format_metrics(job["metrics"])
+        if details and job["state"] == "starting":
+            return f"Starting recording: {name} ({details})"
+        if details and job["state"] == "recording":
+            return f"Recording: {name} ({details})"
+        if details and job["state"] == "converting":
+            return f"Converting {name} -> mp4 ({details})"
+        return None
+    if event == "failed":
+        return f"Failed: {name}"
+    return None
+
+# ---------------- Control API ----------------
+# Small HTTP/1.1 + JSON server on localhost ("127.0.0.1:8621") or a Unix socket
+# ("unix:/path/to.sock"), served by asyncio on its own thread. Handlers only read
+# job snapshots, so heavy polling never blocks the recording threads.
+#   GET /channels              channel list
+#   GET /jobs                  all jobs
+#   POST /jobs                 {"hash", "name", "minutes", "output_dir"} -> new job
+#   GET /jobs/<id|hash>        one job
+#   DELETE /jobs/<id|hash>     stop a job (also POST /jobs/<id|hash>/stop)
+#   GET /events                server-sent events for every job transition
+#   GET /capacity              free slots, ingest bandwidth, disk space
+#   GET /catalog?since=TS      finished recordings
+#   GET /catalog/<id>/thumbnail contact sheet (PNG) of a finished recording;
+#                              202 while it is being made, 503 without ffmpeg
+# With a token every request needs "Authorization: Bearer <token>" (or
+# ?token=<token>, for players opening a preview). Listening on anything but
+# loopback or a Unix socket requires one.
+API_DEFAULT_ADDRESS = "127.0.0.1:8621"
+API_TOKEN = os.environ.get("ACESTREAM_API_TOKEN") or None
+
+def api_is_local(address):
+    if address.startswith("unix:"):
+        return True
+    host = address.rpartition(":")[0].strip("[]")
+    if host in ("", "localhost"):
+        return True
+    import ipaddress
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ControlServer(threading.Thread):
+    REASONS = {200: "OK", 201: "Created", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized",
+               404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error", 503: "Service Unavailable"}
+    EVENT_QUEUE = 256
+
+    def __init__(self, address=API_DEFAULT_ADDRESS, manager=None, token=None):
+        super().__init__(daemon=True, name="control-api")
+        self.address = address
+        self.manager = manager or JOBS
+        self.token = token or API_TOKEN
+        self.loop = None
+        self.ready = threading.Event()
+        self.error = None
+        self.subscribers = set()
+
+    def run(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            # Anyone who can reach the port could start recordings and read the catalog
+            if not self.token and not api_is_local(self.address):
+                raise ValueError(f"Listening on {self.address} needs a token "
+                                 f"(--token or ACESTREAM_API_TOKEN)")
+            if self.address.startswith("unix:"):
+                import stat
+                path = self.address[5:]
+                # Replace a stale socket, never any other kind of file
+                try:
+                    if not stat.S_ISSOCK(os.stat(path).st_mode):
+                        raise OSError(errno.EEXIST, f"{path} exists and is not a socket")
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                # Created 0600 from the start rather than chmod'ed after bind()
+                umask = os.umask(0o177)
+                try:
+                    server = self.loop.run_until_complete(asyncio.start_unix_server(self._client, path=path))
+                finally:
+                    os.umask(umask)
+            else:
+                host, _, port = self.address.rpartition(":")
+                server = self.loop.run_until_complete(
+                    asyncio.start_server(self._client, host or "127.0.0.1", int(port)))
+        except Exception as e:
+            self.error = e
+            self.ready.set()
+            return
+        self.manager.subscribe(self._on_job_event)
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.manager.unsubscribe(self._on_job_event)
+            server.close()
+
+    def shutdown(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    # Called on job threads
+    def _on_job_event(self, event, job):
+        self.loop.call_soon_threadsafe(self._broadcast, {"event": event, "job": job})
+
+    def _broadcast(self, message):
+        for q in self.subscribers:
+            # Slow consumers lose their oldest events rather than growing without bound
+            if q.full():
+                q.get_nowait()
+            q.put_nowait(message)
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode("latin-1").strip().split(" ", 2)
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = h.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+                path, _, query = target.partition("?")
+                path = path.rstrip("/") or "/"
+
+                if not self._authorized(headers, query):
+                    status, payload = 401, {"error": "Missing or wrong API token"}
+                elif method == "GET" and path == "/events":
+                    await self._events(writer)
+                    break
+                else:
+                    try:
+                        status, payload = self._dispatch(method, path, query, body)
+                    except ApiError as e:
+                        status, payload = e.status, {"error": str(e)}
+                    except Exception as e:
+                        status, payload = 500, {"error": str(e)}
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                if isinstance(payload, tuple):
+                    content_type, data = payload
+                else:
+                    content_type, data = "application/json", json.dumps(payload).encode("utf-8")
+                writer.write((f"HTTP/1.1 {status} {self.REASONS.get(status, '')}\r\n"
+                              f"Content-Type: {content_type}\r\n"
+                              f"Content-Length: {len(data)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1")
+                             + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, EOFError):
+            pass
+        finally:
+            writer.close()
+
+    def _authorized(self, headers, query):
+        if not self.token:
+            return True
+        import hmac
+        scheme, _, given = headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer":
+            given = urllib.parse.parse_qs(query).get("token", [""])[0]
+        return hmac.compare_digest(given.strip().encode("utf-8"), self.token.encode("utf-8"))
+
+    def _dispatch(self, method, path, query, body):
+        parts = path.strip("/").split("/")
+        if parts == ["channels"] and method == "GET":
+            try:
+                return 200, cached_channels()
+            except OSError as e:
+                raise ApiError(404, f"Could not read {CHANNELS_FILE}: {e}")
+        if parts == ["capacity"] and method == "GET":
+            return 200, self.manager.capacity()
+        if parts == ["catalog"] and method == "GET":
+            params = urllib.parse.parse_qs(query)
+            try:
+                since = float(params.get("since", ["0"])[0])
+            except ValueError:
+                raise ApiError(400, "since must be a timestamp")
+            return 200, self.manager.catalog_entries(since)
+        if parts[0] == "catalog" and parts[2:] == ["thumbnail"] and method == "GET":
+            return self._thumbnail(parts[1])
+        if parts == ["jobs"]:
+            if method == "GET":
+                return 200, self.manager.list()
+            if method == "POST":
+                return 201, self._create_job(body)
+            raise ApiError(405, "Use GET or POST")
+        if parts[0] == "jobs" and len(parts) == 4 and parts[2] == "preview" and method == "GET":
+            job = self.manager.find(parts[1])
+            preview = getattr(job, "preview", None)
+            if preview is None or preview.ended:
+                raise ApiError(404, f"No live preview for {parts[1]}")
+            if parts[3] == HlsPreview.PLAYLIST:
+                playlist = preview.playlist()
+                token = urllib.parse.parse_qs(query).get("token")
+                if token:
+                    # Players fetch the segments with the playlist's query dropped
+                    suffix = "?token=" + urllib.parse.quote(token[0])
+                    playlist = "\n".join(l + suffix if l and not l.startswith("#") else l
+                                          for l in playlist.split("\n"))
+                return 200, ("application/vnd.apple.mpegurl", playlist.encode("utf-8"))
+            data = preview.segment(parts[3])
+            if data is None:
+                raise ApiError(404, f"Segment {parts[3]} has expired")
+            return 200, ("video/mp2t", data)
+        if parts[0] == "jobs" and len(parts) in (2, 3):
+            job = self.manager.find(parts[1])
+            if job is None:
+                raise ApiError(404, f"No job {parts[1]}")
+            if len(parts) == 2 and method == "GET":
+                return 200, job.snapshot()
+            if (len(parts) == 2 and method == "DELETE") or (parts[2:] == ["stop"] and method == "POST"):
+                job.stop()
+                return 200, job.snapshot()
+            raise ApiError(405, "Unsupported method")
+        raise ApiError(404, f"Unknown path {path}")
+
+    def _thumbnail(self, job_id):
+        entry = next((e for e in reversed(self.manager.catalog_entries()) if e.get("job") == job_id), None)
+        ts = next((f["path"] for f in (entry or {}).get("files", [])
+                   if f.get("path", "").endswith(".ts") and os.path.exists(f["path"])), None)
+        if not THUMBNAILS or ts is None:
+            raise ApiError(404, f"No recording of {job_id} on this host")
+        if not FFMPEG_BIN:
+            raise ApiError(503, "ffmpeg not found")
+        path = THUMBS.request(("file", ts))
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    return 200, ("image/png", f.read())
+            except OSError:
+                pass
+        return 202, {"status": "pending"}
+
+    def _create_job(self, body):
+        try:
+            req = json.loads(body or b"{}")
+        except ValueError:
+            raise ApiError(400, "Body must be JSON")
+        hashid = str(req.get("hash", "")).replace("acestream://", "").strip()
+        if not hashid:
+            raise ApiError(400, "Missing hash")
+        try:
+            minutes = int(req.get("minutes", 60))
+        except (TypeError, ValueError):
+            minutes = 0
+        if minutes <= 0:
+            raise ApiError(400, "minutes must be a positive integer")
+        # Clients must not pick arbitrary places to write to
+        output_dir = req.get("output_dir")
+        if output_dir is not None:
+            volumes = getattr(self.manager, "volumes", None)
+            if not isinstance(output_dir, str) or volumes is None or not volumes.allows(output_dir):
+                raise ApiError(400, "output_dir must be inside one of the output volumes")
+        name = req.get("name")
+        if not name:
+            try:
+                name = next((c["channel"] for c in cached_channels() if c["link"] == hashid), "")
+            except Exception:
+                name = ""
+        try:
+            job = self.manager.submit(hashid, name, minutes, output_dir)
+        except CapacityError as e:
+            raise ApiError(503, str(e))
+        return job.snapshot()
+
+    async def _events(self, writer):
+        import asyncio
+        q = asyncio.Queue(self.EVENT_QUEUE)
+        self.subscribers.add(q)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+            writer.write(self._sse("snapshot", self.manager.list()))
+            await writer.drain()
+            while True:
+                try:
+                    message = await asyncio.wait_for(q.get(), 15)
+                    writer.write(self._sse(message["event"], message["job"]))
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                await writer.drain()
+        finally:
+            self.subscribers.discard(q)
+
+    @staticmethod
+    def _sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+def start_control_server(address, manager=None, token=None):
+    server = ControlServer(address, manager, token)
+    server.start()
+    server.ready.wait(5)
+    if server.error is not None:
+        raise server.error
+    return server
+
+# ---------------- Distributed recording ----------------
+# Workers are ordinary "serve" instances. A coordinator polls their /capacity
+# and /jobs, places each job on the least loaded worker, re-places the rest of
+# a recording elsewhere when a worker stops answering and merges the workers'
+# catalogs into one. It exposes the same control API as a single recorder.
+def http_json(method, url, payload=None, timeout=5, token=None):
+    import urllib.request
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    req = urllib.request.Request(url, data=data, method=method, headers=headers)
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read() or b"null")
+
+class RemoteJob:
+    def __init__(self, coordinator, hashid, name, minutes):
+        self.coordinator = coordinator
+        self.id = uuid.uuid4().hex[:12]
+        self.hash = hashid
+        self.name = name or hashid[:12]
+        self.minutes = minutes
+        self.state = "queued"
+        self.error = None
+        self.created = time.time()
+        self.deadline = None
+        self.remaining = minutes * 60
+        self.worker = None
+        self.remote_id = None
+        self.remote = {}
+        self.segments = []
+        self.failed_on = set()
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.coordinator.stop_job(self)
+
+    def snapshot(self):
+        return {
+            "id": self.id,
+            "hash": self.hash,
+            "name": self.name,
+            "state": self.state,
+            "minutes": self.minutes,
+            "created": self.created,
+            "worker": self.worker,
+            "remote_id": self.remote_id,
+            "segments": list(self.segments),
+            "progress": self.remote.get("progress", 0),
+            "bytes": self.remote.get("bytes", 0),
+            "ttfb": self.remote.get("ttfb"),
+            "output": self.remote.get("output"),
+            "preview": (self.worker + self.remote["preview"]
+                        if self.worker and self.remote.get("preview") else None),
+            "metrics": self.remote.get("metrics", {}),
+            "error": self.error,
+        }
+
+class Coordinator(threading.Thread):
+    DONE = JobManager.DONE
+    FAILURE_LIMIT = 3
+    MIN_RESCHEDULE_SECONDS = 30
+
+    def __init__(self, workers, catalog_path, interval=3.0, token=None):
+        super().__init__(daemon=True, name="coordinator")
+        self.token = token or API_TOKEN
+        self.workers = {url.rstrip("/"): {"alive": False, "failures": 0, "capacity": {}, "since": 0}
+                        for url in workers}
+        self.catalog = Catalog(catalog_path)
+        self.interval = interval
+        self.jobs = {}
+        self.orphans = set()
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.wakeup = threading.Event()
+        for entry in self.catalog.entries():
+            worker = self.workers.get(entry.get("worker"))
+            if worker is not None:
+                worker["since"] = max(worker["since"], entry.get("finished") or 0,
+                                      entry.get("updated") or 0)
+
+    # Same surface as JobManager so ControlServer can serve it
+    def subscribe(self, fn):
+        with self.lock:
+            self.listeners.append(fn)
+
+    def unsubscribe(self, fn):
+        with self.lock:
+            if fn in self.listeners:
+                self.listeners.remove(fn)
+
+    def publish(self, event, job):
+        snap = job.snapshot()
+        with self.lock:
+            listeners = list(self.listeners)
+        for fn in listeners:
+            try:
+                fn(event, snap)
+            except Exception:
+                pass
+
+    def set_state(self, job, state, error=None):
+        if job.state == state and not error:
+            return
+        job.state = state
+        if error:
+            job.error = error
+        self.publish(state, job)
+
+    def submit(self, hashid, name="", minutes=60, output_dir=None):
+        # Placement happens on the coordinator thread, never on the API loop
+        job = RemoteJob(self, hashid, name, minutes)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.publish("queued", job)
+        self.wakeup.set()
+        return job
+
+    def find(self, key):
+        with self.lock:
+            if key in self.jobs:
+                return self.jobs[key]
+            matches = [j for j in self.jobs.values() if j.hash == key]
+        running = [j for j in matches if j.state not in self.DONE]
+        return (running or matches or [None])[-1]
+
+    def list(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [j.snapshot() for j in jobs]
+
+    def stop(self, key):
+        job = self.find(key)
+        if job is not None:
+            self.stop_job(job)
+        return job
+
+    def stop_job(self, job):
+        job.stop_event.set()
+        if job.worker is None:
+            self.set_state(job, "stopped")
+        else:
+            self.wakeup.set()
+
+    def capacity(self):
+        with self.lock:
+            workers = {url: dict(w["capacity"], alive=w["alive"]) for url, w in self.workers.items()}
+        alive = [w for w in workers.values() if w["alive"]]
+        return {
+            "workers": workers,
+            "active": sum(w.get("active", 0) for w in alive),
+            "slots": sum(w.get("slots") or 0 for w in alive),
+            "disk_free": sum(w.get("disk_free", 0) for w in alive),
+        }
+
+    def catalog_entries(self, since=0):
+        return self.catalog.entries(since)
+
+    def run(self):
+        while True:
+            for url in list(self.workers):
+                self._poll_worker(url)
+            self._stop_requested()
+            self._place_queued()
+            self._collect_catalogs()
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def _poll_worker(self, url):
+        worker = self.workers[url]
+        try:
+            capacity = http_json("GET", url + "/capacity", timeout=3, token=self.token)
+            remote_jobs = {j["id"]: j for j in http_json("GET", url + "/jobs", timeout=3, token=self.token)}
+        except Exception:
+            worker["failures"] += 1
+            if worker["alive"] and worker["failures"] >= self.FAILURE_LIMIT:
+                worker["alive"] = False
+                self._worker_lost(url)
+            return
+        worker.update(alive=True, failures=0, capacity=capacity)
+
+        with self.lock:
+            placed = [j for j in self.jobs.values() if j.worker == url and j.state not in self.DONE]
+        for job in placed:
+            remote = remote_jobs.get(job.remote_id)
+            if remote is None:
+                # The worker answers but no longer knows the job (restarted
+                # between two polls): nothing is recording it
+                self._segment_lost(job, url, f"job gone from worker {url}, rescheduling")
+                continue
+            job.remote = remote
+            if remote["state"] in self.DONE:
+                self._segment_done(job, remote)
+            else:
+                self.set_state(job, remote["state"])
+
+        # A worker that comes back after its jobs were moved must not keep recording them
+        for key in list(self.orphans):
+            orphan_url, remote_id = key
+            if orphan_url != url:
+                continue
+            remote = remote_jobs.get(remote_id)
+            if remote is not None and remote["state"] not in self.DONE:
+                try:
+                    http_json("DELETE", f"{url}/jobs/{remote_id}", timeout=3, token=self.token)
+                except Exception:
+                    continue
+            self.orphans.discard(key)
+
+    def _segment_done(self, job, remote):
+        url = job.worker
+        state = remote["state"]
+        job.segments.append({"worker": url, "job": job.remote_id, "output": remote.get("output"),
+                             "state": state})
+        job.worker = None
+        job.remote_id = None
+        # A segment stopped or failed on the worker's side (worker restarted,
+        # engine down there) is continued elsewhere while time is left
+        if state in ("stopped", "failed") and not job.stop_event.is_set():
+            if state == "failed":
+                job.failed_on.add(url)
+            reason = remote.get("error") or f"{state} on worker {url}"
+            self._reschedule(job, f"{reason}, rescheduling", "failed" if state == "failed" else "finished",
+                             remote.get("error"))
+        else:
+            self.set_state(job, "stopped" if job.stop_event.is_set() else "finished")
+
+    def _worker_lost(self, url):
+        with self.lock:
+            lost = [j for j in self.jobs.values() if j.worker == url and j.state not in self.DONE]
+        for job in lost:
+            self.orphans.add((url, job.remote_id))
+            self._segment_lost(job, url, f"worker {url} lost, rescheduling")
+
+    def _segment_lost(self, job, url, reason):
+        job.segments.append({"worker": url, "job": job.remote_id, "output": job.remote.get("output"),
+                             "state": "lost"})
+        job.worker = None
+        job.remote_id = None
+        if job.stop_event.is_set():
+            self.set_state(job, "stopped")
+        else:
+            self._reschedule(job, reason, "finished")
+
+    def _reschedule(self, job, reason, final_state, final_error=None):
+        # Back to the queue for the rest of the recording, unless too little is left
+        job.remaining = job.deadline - time.time()
+        if job.remaining < self.MIN_RESCHEDULE_SECONDS:
+            self.set_state(job, final_state, final_error)
+        else:
+            self.set_state(job, "queued", reason)
+
+    def _stop_requested(self):
+        with self.lock:
+            stopping = [j for j in self.jobs.values()
+                        if j.stop_event.is_set() and j.worker and j.state not in self.DONE]
+        for job in stopping:
+            try:
+                http_json("DELETE", f"{job.worker}/jobs/{job.remote_id}", timeout=3, token=self.token)
+            except Exception:
+                pass
+
+    def _pick_worker(self, job):
+        best = None
+        for url, worker in self.workers.items():
+            cap = worker["capacity"]
+            if not worker["alive"] or cap.get("slots") == 0:
+                continue
+            bandwidth = cap.get("bandwidth_bps")
+            if bandwidth and cap.get("ingest_bps", 0) + PREALLOCATE_MBPS * 125000 > bandwidth:
+                continue
+            if cap.get("disk_free", 0) < job.remaining * PREALLOCATE_MBPS * 125000:
+                continue
+            load = cap.get("active", 0) / (cap.get("max_jobs") or MAX_JOBS)
+            score = (url in job.failed_on, load, cap.get("load", 0) / (cap.get("cpus") or 1),
+                     -cap.get("disk_free", 0))
+            if best is None or score < best[0]:
+                best = (score, url)
+        return best[1] if best else None
+
+    def _place_queued(self):
+        with self.lock:
+            queued = [j for j in self.jobs.values() if j.state == "queued"]
+        for job in queued:
+            url = self._pick_worker(job)
+            if url is None:
+                return
+            minutes = max(1, int(math.ceil(job.remaining / 60)))
+            try:
+                remote = http_json("POST", url + "/jobs",
+                                   {"hash": job.hash, "name": job.name, "minutes": minutes},
+                                   token=self.token)
+            except Exception:
+                # Full or unreachable; the next poll refreshes its capacity
+                self.workers[url]["capacity"]["slots"] = 0
+                continue
+            cap = self.workers[url]["capacity"]
+            cap["active"] = cap.get("active", 0) + 1
+            if cap.get("slots"):
+                cap["slots"] -= 1
+            if job.deadline is None:
+                job.deadline = time.time() + job.remaining
+            job.worker = url
+            job.remote_id = remote["id"]
+            job.remote = remote
+            # The reason it was rescheduled no longer applies
+            job.error = None
+            self.set_state(job, remote["state"])
+
+    def _collect_catalogs(self):
+        for url, worker in self.workers.items():
+            if not worker["alive"]:
+                continue
+            try:
+                entries = http_json("GET", f"{url}/catalog?since={worker['since']}", timeout=5, token=self.token)
+            except Exception:
+                continue
+            for entry in entries:
+                entry["worker"] = url
+                self.catalog.add(entry)
+                worker["since"] = max(worker["since"], entry.get("finished") or 0,
+                                      entry.get("updated") or 0)
+
+# ---------------- GUI toolkit ----------------
+# Imported only when the window is opened, so the command line tools and the
+# API server start without loading GTK or Tk
+USE_GTK = False
+TB_AVAILABLE = False
+
+def load_toolkit():
+    global USE_GTK, TB_AVAILABLE, Gtk, Gdk, GLib, tb, tk, ttk, messagebox, filedialog
+    # Try GTK (PyGObject) first
+    try:
+        import gi
+        gi.require_version("Gtk", "3.0")
+        from gi.repository import Gtk, Gdk, GLib
+        USE_GTK = True
+        return
+    except Exception:
+        USE_GTK = False
+    # Use ttkbootstrap if available for better look; else plain ttk
+    try:
+        import ttkbootstrap as tb
+        TB_AVAILABLE = True
+    except Exception:
+        TB_AVAILABLE = False
+    import tkinter as tk
+    from tkinter import ttk, messagebox, filedialog
+
+# ---------------- GTK UI Implementation ----------------
+class GTKApp:
+    def __init__(self):
+        self.builder = None
+        self.window = Gtk.Window(title="AceStream Recorder — GTK")
+        self.window.set_default_size(900, 650)
+        self.window.connect("destroy", Gtk.main_quit)
+        
+        # State
+        self.links = []
+        self.displayed_indices = []
+        self.selected_hash = None
+        self.rows = {}
+        self.thumb_failed = set()
+        self._thumb_timer = None
+        self.current_job = None
+        self.stop_flag = False
+        JOBS.subscribe(self._on_job_event)
+        self.minuts = 60
+        self.shutdown_after = False
+        self.output_dir = OUTPUT_DIR
+        
+        # UI
+        self._build_ui()
+        self._start_loading()
+        
+        if WATCH_CHANNELS:
+            self.watcher = ChannelFileWatcher(CHANNELS_FILE, self._on_channels_file_changed)
+            self.watcher.start()
+    
+    def _build_ui(self):
+        main = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        self.window.add(main)
+        
+        # Top controls
+        top = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        main.pack_start(top, False, False, 6)
+        
+        btn_refresh = Gtk.Button(label="Refresh")
+        btn_refresh.connect("clicked", lambda w: threading.Thread(target=self.load_links, daemon=True).start())
+        top.pack_start(btn_refresh, False, False, 0)
+        
+        btn_record = Gtk.Button(label="Record Selected")
+        btn_record.connect("clicked", lambda w: self.on_record_selected())
+        top.pack_start(btn_record, False, False, 0)
+        
+        btn_stop = Gtk.Button(label="Stop Recording")
+        btn_stop.connect("clicked", lambda w: self.stop_recording())
+        top.pack_start(btn_stop, False, False, 0)
+        
+        # Search + minutes + shutdown
+        search_area = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        main.pack_start(search_area, False, False, 0)
+        
+        lbl_search = Gtk.Label(label="Search:")
+        search_area.pack_start(lbl_search, False, False, 0)
+        
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_hexpand(True)
+        self.search_entry.connect("search-changed", lambda w: self.on_search_changed())
+        search_area.pack_start(self.search_entry, True, True, 0)
+        
+        lbl_minutes = Gtk.Label(label="Minutes:")
+        search_area.pack_start(lbl_minutes, False, False, 0)
+        
+        self.spin_minutes = Gtk.SpinButton()
+        self.spin_minutes.set_range(1, 1440)
+        self.spin_minutes.set_value(60)
+        search_area.pack_start(self.spin_minutes, False, False, 0)
+        
+        self.shutdown_chk = Gtk.CheckButton(label="Shutdown at end (30s wait)")
+        search_area.pack_start(self.shutdown_chk, False, False, 0)
+        
+        # Output directory selector
+        dir_area = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        main.pack_start(dir_area, False, False, 6)
+        
+        lbl_dir = Gtk.Label(label="Destination directory:")
+        dir_area.pack_start(lbl_dir, False, False, 0)
+        
+        self.entry_output_dir = Gtk.Entry()
+        self.entry_output_dir.set_text(OUTPUT_DIR)
+        self.entry_output_dir.set_hexpand(True)
+        dir_area.pack_start(self.entry_output_dir, True, True, 0)
+        
+        btn_browse = Gtk.Button(label="Browse...")
+        btn_browse.connect("clicked", lambda w: self._browse_directory())
+        dir_area.pack_start(btn_browse, False, False, 0)
+        
+        # List area (scrolled)
+        list_frame = Gtk.Frame(label="Channels (select 1)")
+        main.pack_start(list_frame, True, True, 0)
+        
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        list_frame.add(scrolled)
+        
+        self.listbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+        scrolled.add_with_viewport(self.listbox)
+        self.scroller = scrolled
+        scrolled.get_vadjustment().connect("value-changed", self._queue_thumbnails)
+        self.listbox.connect("size-allocate", self._queue_thumbnails)
+        
+        # Custom link
+        custom_frame = Gtk.Frame(label="Custom link")
+        main.pack_start(custom_frame, False, False, 0)
+        
+        cf = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        custom_frame.add(cf)
+        
+        self.entry_custom = Gtk.Entry()
+        cf.pack_start(self.entry_custom, True, True, 0)
+        
+        btn_custom = Gtk.Button(label="Record Custom")
+        btn_custom.connect("clicked", lambda w: self.on_record_custom())
+        cf.pack_start(btn_custom, False, False, 0)
+        
+        # Status label
+        self.status_label = Gtk.Label(label="Ready")
+        main.pack_start(self.status_label, False, False, 6)
+        
+        self.window.show_all()
+    
+    def _browse_directory(self):
+        dialog = Gtk.FileChooserDialog(
+            title="Select destination directory",
+            parent=self.window,
+            action=Gtk.FileChooserAction.SELECT_FOLDER
+        )
+        dialog.add_buttons(
+            Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+            Gtk.STOCK_OPEN, Gtk.ResponseType.OK
+        )
+        
+        response = dialog.run()
+        if response == Gtk.ResponseType.OK:
+            selected = dialog.get_filename()
+            self.entry_output_dir.set_text(selected)
         
-        def stop_recording(self):
-            self.stop_flag = True
-            if self.current_proc and self.current_proc.poll() is None:
-                try:
-                    if self.current_pg is not None:
-                        os.killpg(self.current_pg, signal.SIGTERM)
-                    else:
-                        self.current_proc.terminate()
-                    time.sleep(0.8)
-                    if self.current_proc.poll() is None:
-                        if self.current_pg is not None:
-                            os.killpg(self.current_pg, signal.SIGKILL)
-                        else:
-                            self.current_proc.kill()
-                except Exception:
-                    pass
-            self._set_ui_sensitive(True)
-            GLib.idle_add(self.set_status, "Stopped by user")
-        
-        def _set_ui_sensitive(self, sensitive):
-            def set_state():
-                self.search_entry.set_sensitive(sensitive)
-                self.spin_minutes.set_sensitive(sensitive)
-                self.entry_custom.set_sensitive(sensitive)
-                self.entry_output_dir.set_sensitive(sensitive)
-                self.shutdown_chk.set_sensitive(sensitive)
-                for child in self.listbox.get_children():
-                    for w in child.get_children():
-                        if isinstance(w, Gtk.RadioButton):
-                            w.set_sensitive(sensitive)
-            GLib.idle_add(set_state)
-    
-    # small helper for GTK messagebox (using Gtk.Dialog)
-    def messagebox_dialog(title, text):
-        dialog = Gtk.MessageDialog(flags=0, message_type=Gtk.MessageType.INFO,
-                                   buttons=Gtk.ButtonsType.OK, text=title)
-        dialog.format_secondary_text(text)
-        dialog.run()
         dialog.destroy()
     
-    def run_gtk():
-        app = GTKApp()
-        Gtk.main()
-
-# ---------------- Ttkbootstrap / tkinter fallback ----------------
-else:
-    # Use ttkbootstrap if available for better look; else plain ttk
-    try:
-        import ttkbootstrap as tb
-        from ttkbootstrap.constants import *
-        TB_AVAILABLE = True
-    except Exception:
-        TB_AVAILABLE = False
-        import tkinter as tk
-        from tkinter import messagebox
+    def set_status(self, text):
+        GLib.idle_add(self.status_label.set_text, text)
     
-    import tkinter as tk
-    from tkinter import ttk, messagebox, filedialog
+    def _on_job_event(self, event, job):
+        text = describe_job_event(event, job)
+        if text:
+            self.set_status(text)
     
-    class TTKApp:
-        def __init__(self, root):
-            self.root = root
-            if TB_AVAILABLE:
-                root.style = tb.Style("flatly")
-            root.title("AceStream Recorder — modern")
-            root.geometry("900x650")
-            
-            self.links = []
-            self.displayed_indices = []
-            self.selected_var = tk.IntVar(value=-1)
-            self.current_proc = None
-            self.current_pg = None
-            self.stop_flag = False
-            self.shutdown_after = tk.BooleanVar(value=False)
-            self.output_dir = OUTPUT_DIR
+    def on_search_changed(self):
+        self.populate_list(self.search_entry.get_text())
+    
+    def _start_loading(self):
+        # Paint the last list right away; channels.json is parsed off the main loop
+        links, fresh = load_channel_snapshot()
+        if links:
+            GLib.idle_add(self.apply_links, links)
+        if not fresh:
+            threading.Thread(target=self.load_links, daemon=True).start()
+    
+    def load_links(self):
+        try:
+            # Read from local channels.json file
+            if not os.path.exists(CHANNELS_FILE):
+                self.set_status(f"Error: channels.json file not found at {CHANNELS_FILE}")
+                return
             
-            self._build_ui()
-            self.load_links()
+            links = load_channels(CHANNELS_FILE)
+            GLib.idle_add(self.apply_links, links)
+        except Exception as e:
+            self.set_status(f"Error loading channels: {e}")
+    
+    def apply_links(self, links):
+        # Patch the existing rows instead of rebuilding the whole list
+        removed, inserted, renamed = diff_channels(self.links, links)
+        self.links = links
+        ft = self.search_entry.get_text()
         
-        def _build_ui(self):
-            top = ttk.Frame(self.root)
-            top.pack(fill=tk.X, padx=10, pady=8)
-            
-            refresh = ttk.Button(top, text="Refresh", command=self.load_links)
-            refresh.pack(side=tk.LEFT)
-            
-            rec = ttk.Button(top, text="Record Selected", command=self.on_record_selected)
-            rec.pack(side=tk.LEFT, padx=6)
-            
-            stop = ttk.Button(top, text="Stop Recording", command=self.stop_recording)
-            stop.pack(side=tk.LEFT, padx=6)
-            
-            # search area
-            search_frame = ttk.Frame(self.root)
-            search_frame.pack(fill=tk.X, padx=10)
-            
-            ttk.Label(search_frame, text="Search:").pack(side=tk.LEFT, padx=(0,6))
-            self.search_entry = ttk.Entry(search_frame)
-            self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
-            self.search_entry.bind("<KeyRelease>", lambda e: self.populate_list(self.search_entry.get()))
-            
-            ttk.Label(search_frame, text="Minutes:").pack(side=tk.LEFT, padx=(6,4))
-            self.entry_minutes = ttk.Entry(search_frame, width=6)
-            self.entry_minutes.insert(0, "60")
-            self.entry_minutes.pack(side=tk.LEFT)
-            
-            ttk.Checkbutton(search_frame, text="Shutdown at end (30s wait)", 
-                           variable=self.shutdown_after).pack(side=tk.LEFT, padx=(8,0))
-            
-            # Output directory area
-            dir_frame = ttk.Frame(self.root)
-            dir_frame.pack(fill=tk.X, padx=10, pady=6)
-            
-            ttk.Label(dir_frame, text="Destination directory:").pack(side=tk.LEFT, padx=(0,6))
-            self.entry_output_dir = ttk.Entry(dir_frame)
-            self.entry_output_dir.insert(0, OUTPUT_DIR)
-            self.entry_output_dir.pack(side=tk.LEFT, fill=tk.X, expand=True)
-            
-            ttk.Button(dir_frame, text="Browse...", 
-                      command=self._browse_directory).pack(side=tk.LEFT, padx=(6,0))
-            
-            # list area
-            list_frame = ttk.Labelframe(self.root, text="Channels (select 1)")
-            list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=8)
-            
-            self.canvas = tk.Canvas(list_frame)
-            self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-            
-            vbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.canvas.yview)
-            vbar.pack(side=tk.RIGHT, fill=tk.Y)
-            self.canvas.configure(yscrollcommand=vbar.set)
-            
-            self.inner = ttk.Frame(self.canvas)
-            self.inner_id = self.canvas.create_window((0,0), window=self.inner, anchor="nw")
-            self.inner.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
-            
-            self.canvas.bind("<Enter>", lambda e: self._bind_mousewheel())
-            self.canvas.bind("<Leave>", lambda e: self._unbind_mousewheel())
-            
-            # custom link
-            custom_frame = ttk.Labelframe(self.root, text="Custom link")
-            custom_frame.pack(fill=tk.X, padx=10, pady=(0,8))
-            
-            self.entry_custom = ttk.Entry(custom_frame)
-            self.entry_custom.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=6, pady=6)
-            
-            ttk.Button(custom_frame, text="Record Custom", 
-                      command=self.on_record_custom).pack(side=tk.LEFT, padx=6, pady=6)
-            
-            self.status_lbl = ttk.Label(self.root, text="Ready")
-            self.status_lbl.pack(fill=tk.X, padx=10, pady=(0,8))
-        
-        def _browse_directory(self):
-            selected = filedialog.askdirectory(
-                title="Select destination directory",
-                initialdir=self.entry_output_dir.get()
-            )
-            if selected:
-                self.entry_output_dir.delete(0, tk.END)
-                self.entry_output_dir.insert(0, selected)
-        
-        def _bind_mousewheel(self):
-            self.canvas.bind_all("<MouseWheel>", self._on_mousewheel)
-            self.canvas.bind_all("<Button-4>", self._on_mousewheel)
-            self.canvas.bind_all("<Button-5>", self._on_mousewheel)
-        
-        def _unbind_mousewheel(self):
-            self.canvas.unbind_all("<MouseWheel>")
-            self.canvas.unbind_all("<Button-4>")
-            self.canvas.unbind_all("<Button-5>")
-        
-        def _on_mousewheel(self, event):
-            if event.num == 4:
-                self.canvas.yview_scroll(-1, "units")
-            elif event.num == 5:
-                self.canvas.yview_scroll(1, "units")
+        for hash_id in removed:
+            row = self.rows.pop(hash_id, None)
+            if row is not None:
+                self.listbox.remove(row)
+            if hash_id == self.selected_hash:
+                self.selected_hash = None
+        
+        by_hash = {item["link"]: item for item in links}
+        for hash_id in renamed:
+            item = by_hash[hash_id]
+            row = self.rows.get(hash_id)
+            if not channel_matches(item, ft):
+                if row is not None:
+                    self.listbox.remove(self.rows.pop(hash_id))
+            elif row is None:
+                self._add_row(item)
             else:
-                delta = int(-1*(event.delta/120))
-                self.canvas.yview_scroll(delta, "units")
+                row.get_children()[1].set_text(f"{item['channel']}   [{hash_id}]")
         
-        def set_status(self, txt):
-            self.status_lbl.config(text=txt)
+        for hash_id in inserted:
+            if channel_matches(by_hash[hash_id], ft):
+                self._add_row(by_hash[hash_id])
         
-        def load_links(self):
-            for w in self.inner.winfo_children():
-                w.destroy()
-            
+        # Keep rows in file order
+        pos = 0
+        for item in links:
+            row = self.rows.get(item["link"])
+            if row is not None:
+                self.listbox.reorder_child(row, pos)
+                pos += 1
+        
+        self.listbox.show_all()
+        self.set_status(f"{len(self.links)} channels loaded from local file "
+                        f"(+{len(inserted)} -{len(removed)} ~{len(renamed)})")
+        return False
+    
+    def _on_channels_file_changed(self):
+        self.load_links()
+    
+    def populate_list(self, filter_text):
+        # clear children
+        for child in self.listbox.get_children():
+            self.listbox.remove(child)
+        self.rows = {}
+        
+        for item in self.links:
+            if channel_matches(item, filter_text):
+                self._add_row(item)
+        
+        self.listbox.show_all()
+    
+    def _add_row(self, item):
+        channel = item.get("channel", "")
+        link = item.get("link", "")
+        works = bool(item.get("work", False))
+        
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        self.listbox.pack_start(row, False, False, 2)
+        
+        # Create radiobutton joined to the group of any existing row
+        group = None
+        for other in self.rows.values():
+            group = other.get_children()[0]
+            break
+        rb = Gtk.RadioButton.new_with_label_from_widget(group, "")
+        
+        # Mark if previously selected
+        if link == self.selected_hash:
+            rb.set_active(True)
+        
+        row.pack_start(rb, False, False, 0)
+        
+        lbl_text = f"{channel}   [{link}]"
+        lbl = Gtk.Label(label=lbl_text, xalign=0)
+        
+        if not works:
+            lbl.set_markup(f"<span foreground='red'>{GLib.markup_escape_text(lbl_text)}</span>")
+        
+        row.pack_start(lbl, True, True, 0)
+        
+        # Filled in by _load_visible_thumbnails once the row is on screen
+        if THUMBNAILS:
+            row.pack_end(Gtk.Image(), False, False, 0)
+        
+        # selection follows the hash, not the row position
+        def on_toggle(rb_button, hash_id=link):
+            if rb_button.get_active():
+                self.selected_hash = hash_id
+        
+        rb.connect("toggled", on_toggle)
+        self.rows[link] = row
+        return row
+    
+    def _queue_thumbnails(self, *args):
+        # Wait for scrolling and resizing to settle
+        if THUMBNAILS and self._thumb_timer is None:
+            self._thumb_timer = GLib.timeout_add(150, self._load_visible_thumbnails)
+    
+    def _load_visible_thumbnails(self):
+        self._thumb_timer = None
+        if not FFMPEG_BIN:
+            return False
+        adj = self.scroller.get_vadjustment()
+        top = adj.get_value()
+        bottom = top + adj.get_page_size()
+        count, width = THUMBNAIL_ROW
+        for hash_id, row in self.rows.items():
+            alloc = row.get_allocation()
+            if alloc.y + alloc.height < top or alloc.y > bottom:
+                continue
+            image = row.get_children()[2]
+            if image.get_storage_type() != Gtk.ImageType.EMPTY:
+                continue
+            source = channel_thumbnail_source(hash_id)
+            if source is None or source in self.thumb_failed:
+                continue
+            done = lambda path, h=hash_id, s=source: GLib.idle_add(self._set_thumbnail, h, s, path)
+            path = THUMBS.request(source, done, count, width)
+            if path is not None:
+                self._set_thumbnail(hash_id, source, path)
+        return False
+    
+    def _set_thumbnail(self, hash_id, source, path):
+        row = self.rows.get(hash_id)
+        if path is None:
+            self.thumb_failed.add(source)
+        elif row is not None:
+            row.get_children()[2].set_from_file(path)
+        return False
+    
+    def on_record_selected(self):
+        if self.selected_hash is None:
+            self.set_status("No channel selected.")
+            return
+        
+        item = next((c for c in self.links if c["link"] == self.selected_hash), None)
+        if item is None:
+            self.set_status("Invalid selection")
+            return
+        
+        link = item.get("link", "")
+        channel = item.get("channel", "Unknown")
+        
+        if not link:
+            self.set_status("Invalid hash")
+            return
+        
+        # Update output directory
+        self.output_dir = self.entry_output_dir.get_text()
+        if not os.path.exists(self.output_dir):
             try:
-                # Read from local channels.json file
-                if not os.path.exists(CHANNELS_FILE):
-                    messagebox.showerror("Error", f"channels.json file not found at {CHANNELS_FILE}")
-                    self.set_status("Error: channels.json file not found")
-                    return
-                
-                with open(CHANNELS_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # Convert to the expected format
-                self.links = []
-                for item in data:
-                    channel = item.get("channel", "")
-                    link = item.get("link", "")
-                    
-                    # Remove acestream:// prefix if present for storage
-                    hash_id = link.replace("acestream://", "") if link else ""
-                    
-                    # Store in the format expected by the rest of the code
-                    self.links.append({
-                        "channel": channel,
-                        "link": hash_id,
-                        "work": True  # Assume all channels work
-                    })
-                
+                os.makedirs(self.output_dir, exist_ok=True)
             except Exception as e:
-                messagebox.showerror("Error", f"Could not load {CHANNELS_FILE}:\n{e}")
-                self.set_status("Error loading channels")
+                self.set_status(f"Error creating directory: {e}")
                 return
-            
-            self.populate_list("")
-            self.set_status(f"{len(self.links)} channels loaded from local file")
         
-        def populate_list(self, filter_text):
-            for w in self.inner.winfo_children():
-                w.destroy()
-            
-            ft = (filter_text or "").strip().lower()
-            
-            for idx, item in enumerate(self.links):
-                channel = item.get("channel", f"channel_{idx}")
-                link = item.get("link", "")
-                works = bool(item.get("work", False))
-                
-                if ft and ft not in channel.lower() and ft not in (link or "").lower():
-                    continue
-                
-                row = ttk.Frame(self.inner)
-                row.pack(fill=tk.X, padx=6, pady=3)
-                
-                rb = ttk.Radiobutton(row, variable=self.selected_var, value=idx)
-                rb.pack(side=tk.LEFT)
-                
-                text = f"{channel}   [{link}]"
-                lbl = ttk.Label(row, text=text)
-                lbl.pack(side=tk.LEFT, fill=tk.X, expand=True)
-                
-                if not works:
-                    lbl.config(foreground="red")
-        
-        def on_record_selected(self):
-            sel = self.selected_var.get()
-            if sel == -1:
-                messagebox.showinfo("Info", "No channel selected")
+        minutes = int(self.spin_minutes.get_value_as_int())
+        self.set_status(f"Starting recording: {channel}")
+        self._set_ui_sensitive(False)
+        self.stop_flag = False
+        
+        thread = threading.Thread(
+            target=self._record_sequence, 
+            args=([(channel, link)], minutes, self.shutdown_chk.get_active()), 
+            daemon=True
+        )
+        thread.start()
+    
+    def on_record_custom(self):
+        val = self.entry_custom.get_text().strip()
+        if not val:
+            self.set_status("Enter hash or acestream://hash")
+            return
+        
+        if val.startswith("acestream://"):
+            hashid = val.replace("acestream://", "").strip()
+        else:
+            hashid = val
+        
+        # Update output directory
+        self.output_dir = self.entry_output_dir.get_text()
+        if not os.path.exists(self.output_dir):
+            try:
+                os.makedirs(self.output_dir, exist_ok=True)
+            except Exception as e:
+                self.set_status(f"Error creating directory: {e}")
                 return
+        
+        minutes = int(self.spin_minutes.get_value_as_int())
+        self.set_status("Starting recording: Custom")
+        self._set_ui_sensitive(False)
+        self.stop_flag = False
+        
+        thread = threading.Thread(
+            target=self._record_sequence, 
+            args=([("Custom", hashid)], minutes, self.shutdown_chk.get_active()), 
+            daemon=True
+        )
+        thread.start()
+    
+    def _record_sequence(self, sequence, minutes, shutdown_after):
+        all_success = True
+        usage = []
+        
+        for display_name, hashid in sequence:
+            if self.stop_flag:
+                all_success = False
+                break
             
-            item = self.links[sel]
-            link = item.get("link", "")
-            channel = item.get("channel", "")
+            job = JOBS.add(Job(hashid, display_name, minutes, JOBS.place(self.output_dir, minutes)))
+            self.current_job = job
+            if self.stop_flag:
+                job.stop()
+            JOBS.run(job)
+            self.current_job = None
+            usage = job.summary()
             
-            if not link:
-                messagebox.showerror("Error", "Invalid hash")
-                return
+            if job.state == "failed":
+                all_success = False
+                if job.error:
+                    GLib.idle_add(lambda e=job.error: messagebox_dialog("Warning", e))
             
-            # Update output directory
-            self.output_dir = self.entry_output_dir.get()
-            if not os.path.exists(self.output_dir):
-                try:
-                    os.makedirs(self.output_dir, exist_ok=True)
-                except Exception as e:
-                    messagebox.showerror("Error", f"Error creating directory: {e}")
+            time.sleep(0.6)
+        
+        GLib.idle_add(self._set_ui_sensitive, True)
+        
+        if shutdown_after and all_success and not self.stop_flag:
+            GLib.idle_add(self.set_status, "Waiting 30 seconds before shutdown...")
+            for i in range(30, 0, -1):
+                if self.stop_flag:
+                    GLib.idle_add(self.set_status, "Shutdown cancelled")
                     return
+                GLib.idle_add(self.set_status, f"Shutting down in {i} seconds... (stop to cancel)")
+                time.sleep(1)
             
             try:
-                minutes = int(self.entry_minutes.get())
+                subprocess.Popen(["systemctl", "poweroff"])
             except Exception:
-                messagebox.showerror("Error", "Invalid minutes")
-                return
-            
-            self.set_status(f"Starting recording: {channel}")
-            self._set_ui_state(False)
-            self.stop_flag = False
-            
-            threading.Thread(
-                target=self._record_sequence, 
-                args=([(channel, link)], minutes, self.shutdown_after.get()), 
-                daemon=True
-            ).start()
-        
-        def on_record_custom(self):
-            val = self.entry_custom.get().strip()
-            if not val:
-                messagebox.showinfo("Info", "Enter hash or link")
+                GLib.idle_add(self.set_status, "Finished (error shutting down)")
+        else:
+            if self.stop_flag:
+                GLib.idle_add(self.set_status, "Stopped by user")
+            else:
+                GLib.idle_add(self.set_status, "; ".join(["Finished"] + usage))
+    
+    def stop_recording(self):
+        self.stop_flag = True
+        if self.current_job is not None:
+            self.current_job.stop()
+        self._set_ui_sensitive(True)
+        GLib.idle_add(self.set_status, "Stopped by user")
+    
+    def _set_ui_sensitive(self, sensitive):
+        def set_state():
+            self.search_entry.set_sensitive(sensitive)
+            self.spin_minutes.set_sensitive(sensitive)
+            self.entry_custom.set_sensitive(sensitive)
+            self.entry_output_dir.set_sensitive(sensitive)
+            self.shutdown_chk.set_sensitive(sensitive)
+            for child in self.listbox.get_children():
+                for w in child.get_children():
+                    if isinstance(w, Gtk.RadioButton):
+                        w.set_sensitive(sensitive)
+        GLib.idle_add(set_state)
+
+# small helper for GTK messagebox (using Gtk.Dialog)
+def messagebox_dialog(title, text):
+    dialog = Gtk.MessageDialog(flags=0, message_type=Gtk.MessageType.INFO,
+                               buttons=Gtk.ButtonsType.OK, text=title)
+    dialog.format_secondary_text(text)
+    dialog.run()
+    dialog.destroy()
+
+def run_gtk():
+    app = GTKApp()
+    if os.environ.get("ACESTREAM_STARTUP_PROBE"):
+        # Idle callbacks run after the first frame has been drawn
+        GLib.idle_add(lambda: report_startup() or Gtk.main_quit())
+    Gtk.main()
+
+# ---------------- Ttkbootstrap / tkinter fallback ----------------
+class TTKApp:
+    def __init__(self, root):
+        self.root = root
+        if TB_AVAILABLE:
+            root.style = tb.Style("flatly")
+        root.title("AceStream Recorder — modern")
+        root.geometry("900x650")
+        
+        self.links = []
+        self.displayed_indices = []
+        self.selected_var = tk.StringVar(value="")
+        self.rows = {}
+        self.thumb_failed = set()
+        self._thumb_view = None
+        self.current_job = None
+        self.stop_flag = False
+        JOBS.subscribe(self._on_job_event)
+        self.shutdown_after = tk.BooleanVar(value=False)
+        self.output_dir = OUTPUT_DIR
+        
+        self._build_ui()
+        self._start_loading()
+        if THUMBNAILS:
+            self.root.after(250, self._poll_thumbnails)
+        
+        if WATCH_CHANNELS:
+            self.watcher = ChannelFileWatcher(CHANNELS_FILE, self._on_channels_file_changed)
+            self.watcher.start()
+    
+    def _build_ui(self):
+        top = ttk.Frame(self.root)
+        top.pack(fill=tk.X, padx=10, pady=8)
+        
+        refresh = ttk.Button(top, text="Refresh", command=self.load_links)
+        refresh.pack(side=tk.LEFT)
+        
+        rec = ttk.Button(top, text="Record Selected", command=self.on_record_selected)
+        rec.pack(side=tk.LEFT, padx=6)
+        
+        stop = ttk.Button(top, text="Stop Recording", command=self.stop_recording)
+        stop.pack(side=tk.LEFT, padx=6)
+        
+        # search area
+        search_frame = ttk.Frame(self.root)
+        search_frame.pack(fill=tk.X, padx=10)
+        
+        ttk.Label(search_frame, text="Search:").pack(side=tk.LEFT, padx=(0,6))
+        self.search_entry = ttk.Entry(search_frame)
+        self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.search_entry.bind("<KeyRelease>", lambda e: self.populate_list(self.search_entry.get()))
+        
+        ttk.Label(search_frame, text="Minutes:").pack(side=tk.LEFT, padx=(6,4))
+        self.entry_minutes = ttk.Entry(search_frame, width=6)
+        self.entry_minutes.insert(0, "60")
+        self.entry_minutes.pack(side=tk.LEFT)
+        
+        ttk.Checkbutton(search_frame, text="Shutdown at end (30s wait)", 
+                       variable=self.shutdown_after).pack(side=tk.LEFT, padx=(8,0))
+        
+        # Output directory area
+        dir_frame = ttk.Frame(self.root)
+        dir_frame.pack(fill=tk.X, padx=10, pady=6)
+        
+        ttk.Label(dir_frame, text="Destination directory:").pack(side=tk.LEFT, padx=(0,6))
+        self.entry_output_dir = ttk.Entry(dir_frame)
+        self.entry_output_dir.insert(0, OUTPUT_DIR)
+        self.entry_output_dir.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        ttk.Button(dir_frame, text="Browse...", 
+                  command=self._browse_directory).pack(side=tk.LEFT, padx=(6,0))
+        
+        # list area
+        list_frame = ttk.Labelframe(self.root, text="Channels (select 1)")
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=8)
+        
+        self.canvas = tk.Canvas(list_frame)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        vbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.canvas.yview)
+        vbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.configure(yscrollcommand=vbar.set)
+        
+        self.inner = ttk.Frame(self.canvas)
+        self.inner_id = self.canvas.create_window((0,0), window=self.inner, anchor="nw")
+        self.inner.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
+        
+        self.canvas.bind("<Enter>", lambda e: self._bind_mousewheel())
+        self.canvas.bind("<Leave>", lambda e: self._unbind_mousewheel())
+        
+        # custom link
+        custom_frame = ttk.Labelframe(self.root, text="Custom link")
+        custom_frame.pack(fill=tk.X, padx=10, pady=(0,8))
+        
+        self.entry_custom = ttk.Entry(custom_frame)
+        self.entry_custom.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=6, pady=6)
+        
+        ttk.Button(custom_frame, text="Record Custom", 
+                  command=self.on_record_custom).pack(side=tk.LEFT, padx=6, pady=6)
+        
+        self.status_lbl = ttk.Label(self.root, text="Ready")
+        self.status_lbl.pack(fill=tk.X, padx=10, pady=(0,8))
+    
+    def _browse_directory(self):
+        selected = filedialog.askdirectory(
+            title="Select destination directory",
+            initialdir=self.entry_output_dir.get()
+        )
+        if selected:
+            self.entry_output_dir.delete(0, tk.END)
+            self.entry_output_dir.insert(0, selected)
+    
+    def _bind_mousewheel(self):
+        self.canvas.bind_all("<MouseWheel>", self._on_mousewheel)
+        self.canvas.bind_all("<Button-4>", self._on_mousewheel)
+        self.canvas.bind_all("<Button-5>", self._on_mousewheel)
+    
+    def _unbind_mousewheel(self):
+        self.canvas.unbind_all("<MouseWheel>")
+        self.canvas.unbind_all("<Button-4>")
+        self.canvas.unbind_all("<Button-5>")
+    
+    def _on_mousewheel(self, event):
+        if event.num == 4:
+            self.canvas.yview_scroll(-1, "units")
+        elif event.num == 5:
+            self.canvas.yview_scroll(1, "units")
+        else:
+            delta = int(-1*(event.delta/120))
+            self.canvas.yview_scroll(delta, "units")
+    
+    def set_status(self, txt):
+        self.status_lbl.config(text=txt)
+    
+    def _on_job_event(self, event, job):
+        # Job events arrive on recording threads
+        text = describe_job_event(event, job)
+        if text:
+            self.root.after(0, self.set_status, text)
+    
+    def _start_loading(self):
+        # Paint the last list right away; channels.json is parsed on a thread
+        links, fresh = load_channel_snapshot()
+        if links:
+            self.root.after_idle(self.apply_links, links)
+        if not fresh:
+            self.load_links()
+    
+    def load_links(self):
+        threading.Thread(target=self._read_links, daemon=True).start()
+    
+    def _read_links(self):
+        # Runs on a thread; results are handed back to the Tk loop
+        try:
+            # Read from local channels.json file
+            if not os.path.exists(CHANNELS_FILE):
+                self.root.after(0, self._load_failed, f"channels.json file not found at {CHANNELS_FILE}",
+                                "Error: channels.json file not found")
                 return
             
-            if val.startswith("acestream://"):
-                hashid = val.replace("acestream://", "").strip()
+            links = load_channels(CHANNELS_FILE)
+        except Exception as e:
+            self.root.after(0, self._load_failed, f"Could not load {CHANNELS_FILE}:\n{e}",
+                            "Error loading channels")
+            return
+        
+        self.root.after(0, self.apply_links, links)
+    
+    def _load_failed(self, message, status):
+        messagebox.showerror("Error", message)
+        self.set_status(status)
+    
+    def _on_channels_file_changed(self):
+        # Called from the watcher thread; a half-written file is simply retried on the next event
+        try:
+            links = load_channels(CHANNELS_FILE)
+        except Exception:
+            return
+        self.root.after(0, self.apply_links, links)
+    
+    def apply_links(self, links):
+        # Patch the existing rows instead of rebuilding the whole list
+        removed, inserted, renamed = diff_channels(self.links, links)
+        self.links = links
+        ft = self.search_entry.get()
+        
+        for hash_id in removed:
+            row = self.rows.pop(hash_id, None)
+            if row is not None:
+                row.destroy()
+            if hash_id == self.selected_var.get():
+                self.selected_var.set("")
+        
+        by_hash = {item["link"]: item for item in links}
+        pending = set(h for h in inserted if channel_matches(by_hash[h], ft))
+        for hash_id in renamed:
+            item = by_hash[hash_id]
+            row = self.rows.get(hash_id)
+            if not channel_matches(item, ft):
+                if row is not None:
+                    self.rows.pop(hash_id).destroy()
+            elif row is not None:
+                row.winfo_children()[1].config(text=f"{item['channel']}   [{hash_id}]")
             else:
-                hashid = val
-            
-            # Update output directory
-            self.output_dir = self.entry_output_dir.get()
-            if not os.path.exists(self.output_dir):
-                try:
-                    os.makedirs(self.output_dir, exist_ok=True)
-                except Exception as e:
-                    messagebox.showerror("Error", f"Error creating directory: {e}")
-                    return
-            
+                pending.add(hash_id)
+        
+        # New rows go in front of the next row that follows them in the file
+        following = None
+        for item in reversed(links):
+            hash_id = item["link"]
+            if hash_id in pending:
+                self.rows[hash_id] = self._add_row(item, before=following)
+            if hash_id in self.rows:
+                following = self.rows[hash_id]
+        
+        self.set_status(f"{len(self.links)} channels loaded from local file "
+                        f"(+{len(inserted)} -{len(removed)} ~{len(renamed)})")
+    
+    def populate_list(self, filter_text):
+        for w in self.inner.winfo_children():
+            w.destroy()
+        self.rows = {}
+        
+        for item in self.links:
+            if channel_matches(item, filter_text):
+                self.rows[item["link"]] = self._add_row(item)
+    
+    def _add_row(self, item, before=None):
+        channel = item.get("channel", "")
+        link = item.get("link", "")
+        works = bool(item.get("work", False))
+        
+        row = ttk.Frame(self.inner)
+        if before is not None:
+            row.pack(fill=tk.X, padx=6, pady=3, before=before)
+        else:
+            row.pack(fill=tk.X, padx=6, pady=3)
+        
+        rb = ttk.Radiobutton(row, variable=self.selected_var, value=link)
+        rb.pack(side=tk.LEFT)
+        
+        text = f"{channel}   [{link}]"
+        lbl = ttk.Label(row, text=text)
+        # Filled in by _load_visible_thumbnails once the row is on screen
+        if THUMBNAILS:
+            ttk.Label(row).pack(side=tk.RIGHT)
+        lbl.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        if not works:
+            lbl.config(foreground="red")
+        return row
+    
+    def _poll_thumbnails(self):
+        view = (self.canvas.canvasy(0), self.canvas.winfo_height(),
+                self.inner.winfo_height(), len(self.rows))
+        if view != self._thumb_view:
+            self._thumb_view = view
+            self._load_visible_thumbnails()
+        self.root.after(250, self._poll_thumbnails)
+    
+    def _load_visible_thumbnails(self):
+        if not FFMPEG_BIN:
+            return
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        count, width = THUMBNAIL_ROW
+        for hash_id, row in self.rows.items():
+            y = row.winfo_y()
+            if y + row.winfo_height() < top or y > bottom:
+                continue
+            if str(row.winfo_children()[2].cget("image")):
+                continue
+            source = channel_thumbnail_source(hash_id)
+            if source is None or source in self.thumb_failed:
+                continue
+            done = lambda path, h=hash_id, s=source: self.root.after(0, self._set_thumbnail, h, s, path)
+            path = THUMBS.request(source, done, count, width)
+            if path is not None:
+                self._set_thumbnail(hash_id, source, path)
+    
+    def _set_thumbnail(self, hash_id, source, path):
+        row = self.rows.get(hash_id)
+        if path is None:
+            self.thumb_failed.add(source)
+            return
+        if row is None or not row.winfo_exists():
+            return
+        try:
+            image = tk.PhotoImage(file=path)
+        except tk.TclError:
+            self.thumb_failed.add(source)
+            return
+        thumb = row.winfo_children()[2]
+        thumb.image = image
+        thumb.config(image=image)
+    
+    def on_record_selected(self):
+        sel = self.selected_var.get()
+        item = next((c for c in self.links if c["link"] == sel), None) if sel else None
+        if item is None:
+            messagebox.showinfo("Info", "No channel selected")
+            return
+        
+        link = item.get("link", "")
+        channel = item.get("channel", "")
+        
+        if not link:
+            messagebox.showerror("Error", "Invalid hash")
+            return
+        
+        # Update output directory
+        self.output_dir = self.entry_output_dir.get()
+        if not os.path.exists(self.output_dir):
             try:
-                minutes = int(self.entry_minutes.get())
-            except Exception:
-                messagebox.showerror("Error", "Invalid minutes")
+                os.makedirs(self.output_dir, exist_ok=True)
+            except Exception as e:
+                messagebox.showerror("Error", f"Error creating directory: {e}")
                 return
-            
-            self.set_status("Starting recording: Custom")
-            self._set_ui_state(False)
-            self.stop_flag = False
-            
-            threading.Thread(
-                target=self._record_sequence, 
-                args=([("Custom", hashid)], minutes, self.shutdown_after.get()), 
-                daemon=True
-            ).start()
-        
-        def _record_sequence(self, sequence, minutes, shutdown_after):
-            ensure_engine()
-            all_success = True
-            
-            for display_name, hashid in sequence:
-                if self.stop_flag:
-                    all_success = False
-                    break
-                
-                self.set_status(f"Recording: {display_name}")
-                ts = datetime.now().strftime("%Y-%m-d_%H-%M-%S")
-                fname = safe_name(display_name) if display_name else hashid[:12]
-                output_ts = os.path.join(self.output_dir, f"acestream_{fname}_{ts}.ts")
-                
-                ok = self._record_one_proc(hashid, output_ts, minutes)
-                
-                if not ok:
-                    all_success = False
-                else:
-                    # conversion
-                    if FFMPEG_BIN:
-                        self.set_status(f"Converting {fname} -> mp4")
-                        mp4_path = os.path.splitext(output_ts)[0] + ".mp4"
-                        try:
-                            conv_cmd = [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", 
-                                       "-i", output_ts, "-c", "copy", mp4_path]
-                            conv_proc = subprocess.run(conv_cmd, stdout=subprocess.PIPE, 
-                                                      stderr=subprocess.PIPE, text=True)
-                            if conv_proc.returncode != 0:
-                                all_success = False
-                        except Exception:
-                            all_success = False
-                    else:
-                        all_success = False
-                
-                time.sleep(0.6)
-            
-            self._set_ui_state(True)
-            
-            if shutdown_after and all_success and not self.stop_flag:
-                self.set_status("Waiting 30 seconds before shutdown...")
-                for i in range(30, 0, -1):
-                    if self.stop_flag:
-                        self.set_status("Shutdown cancelled")
-                        return
-                    self.set_status(f"Shutting down in {i} seconds... (stop to cancel)")
-                    time.sleep(1)
-                
-                try:
-                    subprocess.Popen(["systemctl", "poweroff"])
-                except Exception:
-                    self.set_status("Finished (error shutting down)")
-            else:
-                if self.stop_flag:
-                    self.set_status("Stopped by user")
-                else:
-                    self.set_status("Finished")
         
-        def _record_one_proc(self, hashid, output_ts, minutes):
-            cmd = [PLAYER, f"acestream://{hashid}", "--vo=null", "--quiet", f"--stream-record={output_ts}"]
-            
+        try:
+            minutes = int(self.entry_minutes.get())
+        except Exception:
+            messagebox.showerror("Error", "Invalid minutes")
+            return
+        
+        self.set_status(f"Starting recording: {channel}")
+        self._set_ui_state(False)
+        self.stop_flag = False
+        
+        threading.Thread(
+            target=self._record_sequence, 
+            args=([(channel, link)], minutes, self.shutdown_after.get()), 
+            daemon=True
+        ).start()
+    
+    def on_record_custom(self):
+        val = self.entry_custom.get().strip()
+        if not val:
+            messagebox.showinfo("Info", "Enter hash or link")
+            return
+        
+        if val.startswith("acestream://"):
+            hashid = val.replace("acestream://", "").strip()
+        else:
+            hashid = val
+        
+        # Update output directory
+        self.output_dir = self.entry_output_dir.get()
+        if not os.path.exists(self.output_dir):
             try:
-                proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, 
-                                       preexec_fn=os.setsid)
-            except FileNotFoundError:
-                messagebox.showerror("Error", f"Could not find '{PLAYER}' in PATH.")
-                self._set_ui_state(True)
-                self.set_status("Error: player not found")
-                return False
-            except Exception:
-                return False
+                os.makedirs(self.output_dir, exist_ok=True)
+            except Exception as e:
+                messagebox.showerror("Error", f"Error creating directory: {e}")
+                return
+        
+        try:
+            minutes = int(self.entry_minutes.get())
+        except Exception:
+            messagebox.showerror("Error", "Invalid minutes")
+            return
+        
+        self.set_status("Starting recording: Custom")
+        self._set_ui_state(False)
+        self.stop_flag = False
+        
+        threading.Thread(
+            target=self._record_sequence, 
+            args=([("Custom", hashid)], minutes, self.shutdown_after.get()), 
+            daemon=True
+        ).start()
+    
+    def _record_sequence(self, sequence, minutes, shutdown_after):
+        all_success = True
+        usage = []
+        
+        for display_name, hashid in sequence:
+            if self.stop_flag:
+                all_success = False
+                break
             
-            self.current_proc = proc
-            try:
-                self.current_pg = os.getpgid(proc.pid)
-            except Exception:
-                self.current_pg = None
+            job = JOBS.add(Job(hashid, display_name, minutes, JOBS.place(self.output_dir, minutes)))
+            self.current_job = job
+            if self.stop_flag:
+                job.stop()
+            JOBS.run(job)
+            self.current_job = None
+            usage = job.summary()
             
-            total = minutes * 60
-            start = time.time()
+            if job.state == "failed":
+                all_success = False
+                if job.error:
+                    messagebox.showwarning("Warning", job.error)
+            elif not FFMPEG_BIN:
+                all_success = False
             
-            while True:
+            time.sleep(0.6)
+        
+        self._set_ui_state(True)
+        
+        if shutdown_after and all_success and not self.stop_flag:
+            self.set_status("Waiting 30 seconds before shutdown...")
+            for i in range(30, 0, -1):
                 if self.stop_flag:
-                    break
-                if proc.poll() is not None:
-                    break
-                if (time.time() - start) >= total:
-                    break
-                time.sleep(0.4)
-            
-            if proc.poll() is None:
-                try:
-                    if self.current_pg is not None:
-                        os.killpg(self.current_pg, signal.SIGTERM)
-                    else:
-                        proc.terminate()
-                    time.sleep(1.2)
-                    if proc.poll() is None:
-                        if self.current_pg is not None:
-                            os.killpg(self.current_pg, signal.SIGKILL)
-                        else:
-                            proc.kill()
-                except Exception:
-                    pass
-            
-            self.current_proc = None
-            self.current_pg = None
-            
-            if not os.path.exists(output_ts) or os.path.getsize(output_ts) == 0:
-                messagebox.showwarning("Warning", f"File may be empty or not created:\n{output_ts}")
-                return False
+                    self.set_status("Shutdown cancelled")
+                    return
+                self.set_status(f"Shutting down in {i} seconds... (stop to cancel)")
+                time.sleep(1)
             
-            return True
+            try:
+                subprocess.Popen(["systemctl", "poweroff"])
+            except Exception:
+                self.set_status("Finished (error shutting down)")
+        else:
+            if self.stop_flag:
+                self.set_status("Stopped by user")
+            else:
+                self.set_status("; ".join(["Finished"] + usage))
+    
+    def stop_recording(self):
+        self.stop_flag = True
+        if self.current_job is not None:
+            self.current_job.stop()
+        self._set_ui_state(True)
+        self.set_status("Stopped by user")
+    
+    def _set_ui_state(self, enabled):
+        state = "normal" if enabled else "disabled"
+        try:
+            self.search_entry.config(state=state)
+            self.entry_minutes.config(state=state)
+            self.entry_custom.config(state=state)
+            self.entry_output_dir.config(state=state)
+        except Exception:
+            pass
         
-        def stop_recording(self):
-            self.stop_flag = True
-            if self.current_proc and self.current_proc.poll() is None:
+        for child in self.inner.winfo_children():
+            for w in child.winfo_children():
                 try:
-                    if self.current_pg is not None:
-                        os.killpg(self.current_pg, signal.SIGTERM)
-                    else:
-                        self.current_proc.terminate()
-                    time.sleep(0.8)
-                    if self.current_proc.poll() is None:
-                        if self.current_pg is not None:
-                            os.killpg(self.current_pg, signal.SIGKILL)
-                        else:
-                            self.current_proc.kill()
+                    w.config(state=state)
                 except Exception:
                     pass
-            self._set_ui_state(True)
-            self.set_status("Stopped by user")
-        
-        def _set_ui_state(self, enabled):
-            state = "normal" if enabled else "disabled"
-            try:
-                self.search_entry.config(state=state)
-                self.entry_minutes.config(state=state)
-                self.entry_custom.config(state=state)
-                self.entry_output_dir.config(state=state)
-            except Exception:
-                pass
-            
-            for child in self.inner.winfo_children():
-                for w in child.winfo_children():
-                    try:
-                        w.config(state=state)
-                    except Exception:
-                        pass
-    
-    def run_ttk():
-        if TB_AVAILABLE:
-            root = tb.Window(themename="flatly")
-        else:
-            root = tk.Tk()
-        app = TTKApp(root)
-        root.mainloop()
+
+def run_ttk():
+    if TB_AVAILABLE:
+        root = tb.Window(themename="flatly")
+    else:
+        root = tk.Tk()
+    app = TTKApp(root)
+    if os.environ.get("ACESTREAM_STARTUP_PROBE"):
+        def probe():
+            root.update()
+            report_startup()
+            root.destroy()
+        root.after_idle(probe)
+    root.mainloop()
 
 # ---------------- Main entry ----------------
+def report_startup():
+    # ACESTREAM_STARTUP_PROBE holds the launcher's time.time()
+    print(f"window shown after {time.time() - float(os.environ['ACESTREAM_STARTUP_PROBE']):.3f}s", flush=True)
+
+def startup_benchmark(runs=5):
+    # -> {"import": median seconds, "window": median seconds or None, "toolkit_imported": bool}
+    script = os.path.abspath(__file__)
+    module = os.path.splitext(os.path.basename(script))[0]
+    code = (f"import sys, time; sys.path.insert(0, {os.path.dirname(script)!r}); t = time.perf_counter(); "
+            f"import {module}; print(time.perf_counter() - t, "
+            f"any(m in sys.modules for m in ('gi', 'tkinter', 'ttkbootstrap')))")
+    imports, windows, toolkit = [], [], False
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True, timeout=60)
+        seconds, loaded = out.stdout.decode().split()
+        imports.append(float(seconds))
+        toolkit = toolkit or loaded == "True"
+        if os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"):
+            env = dict(os.environ, ACESTREAM_STARTUP_PROBE=repr(time.time()))
+            out = subprocess.run([sys.executable, script], stdout=subprocess.PIPE, env=env, timeout=60)
+            m = re.search(rb"window shown after ([\d.]+)s", out.stdout)
+            if m:
+                windows.append(float(m.group(1)))
+
+    def median(values):
+        return sorted(values)[len(values) // 2] if values else None
+
+    return {"import": median(imports), "window": median(windows), "toolkit_imported": toolkit}
+
+def run_server(address, manager, token=None):
+    try:
+        server = start_control_server(address, manager, token)
+    except Exception as e:
+        sys.exit(f"Error: {e}")
+    print(f"Control API listening on {address}")
+    try:
+        while server.is_alive():
+            server.join(1)
+    except KeyboardInterrupt:
+        pass
+    for job in manager.list():
+        if job["state"] not in JobManager.DONE:
+            manager.stop(job["id"])
+    # Give recordings a moment to close their files
+    deadline = time.time() + 10
+    while time.time() < deadline and any(j["state"] in ("starting", "recording") for j in manager.list()):
+        time.sleep(0.2)
+
 def main():
-    if USE_GTK:
-        run_gtk()
+    parser = argparse.ArgumentParser(description="Record AceStream channels")
+    parser.add_argument("--trace", metavar="FILE", default=os.environ.get("ACESTREAM_TRACE"),
+                        help="write phase timings as Chrome trace JSON")
+    parser.add_argument("--profile", action="store_true",
+                        default=os.environ.get("ACESTREAM_PROFILE") == "1",
+                        help="with --trace, also write cProfile stats to FILE.prof")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        default=os.environ.get("ACESTREAM_TRACEMALLOC") == "1",
+                        help="with --trace, also record Python heap snapshots")
+    parser.add_argument("--api", metavar="ADDRESS", default=os.environ.get("ACESTREAM_API"),
+                        help="also serve the control API on HOST:PORT or unix:/path")
+    parser.add_argument("--token", default=API_TOKEN,
+                        help="shared secret for the control API and for workers (default: $ACESTREAM_API_TOKEN)")
+    sub = parser.add_subparsers(dest="command")
+    
+    p_clip = sub.add_parser("clip", help="extract a time range from a recording without re-scanning it")
+    p_clip.add_argument("input", help="recorded .ts file")
+    p_clip.add_argument("start", help="start time (seconds or HH:MM:SS)")
+    p_clip.add_argument("end", help="end time (seconds or HH:MM:SS)")
+    p_clip.add_argument("-o", "--output", help="output file (default: next to the input)")
+    
+    p_index = sub.add_parser("index", help="rebuild the keyframe index of a recording")
+    p_index.add_argument("input", help="recorded .ts file")
+    
+    p_archive = sub.add_parser("archive", help="re-encode a recording into a smaller mp4 using all cores")
+    p_archive.add_argument("input", help="recorded .ts file")
+    p_archive.add_argument("--workers", type=int, default=None,
+                           help="parallel chunk encoders (default: number of CPUs)")
+    
+    p_thumb = sub.add_parser("thumbnail", help="make (or reuse) a contact sheet of a recording")
+    p_thumb.add_argument("input", help="recorded .ts file")
+    p_thumb.add_argument("-o", "--output", help="copy the PNG here (default: print its cache path)")
+    p_thumb.add_argument("--count", type=int, default=THUMBNAIL_COUNT, help="frames (default: %(default)s)")
+    p_thumb.add_argument("--width", type=int, default=THUMBNAIL_WIDTH,
+                         help="width of each frame in pixels (default: %(default)s)")
+    
+    p_serve = sub.add_parser("serve", help="run the control API without a GUI (also a coordinator worker)")
+    p_serve.add_argument("--listen", default=API_DEFAULT_ADDRESS,
+                         help="HOST:PORT or unix:/path/to.sock (default: %(default)s)")
+    p_serve.add_argument("--slots", type=int, default=MAX_JOBS,
+                         help="concurrent recordings accepted (default: %(default)s)")
+    p_serve.add_argument("--output-dir", default=OUTPUT_DIR, help="where recordings are written")
+    p_serve.add_argument("--volume", action="append", metavar="DIR",
+                         help="extra output volume to spread recordings over (repeatable)")
+    
+    p_rebalance = sub.add_parser("rebalance", help="move finished recordings until the output volumes are balanced")
+    p_rebalance.add_argument("--output-dir", default=OUTPUT_DIR, help="default volume (holds the catalog)")
+    p_rebalance.add_argument("--volume", action="append", metavar="DIR", help="extra output volume (repeatable)")
+    p_rebalance.add_argument("--threshold", type=float, default=REBALANCE_THRESHOLD,
+                             help="allowed difference in used fraction (default: %(default)s)")
+    
+    p_bench = sub.add_parser("startup-bench", help="measure start-up time; fails if over STARTUP_BUDGET")
+    p_bench.add_argument("--runs", type=int, default=5, help="runs to take the median of (default: %(default)s)")
+    
+    p_coord = sub.add_parser("coordinator", help="spread recordings over several worker hosts")
+    p_coord.add_argument("--listen", default=API_DEFAULT_ADDRESS,
+                         help="HOST:PORT or unix:/path/to.sock (default: %(default)s)")
+    p_coord.add_argument("--worker", action="append", required=True, metavar="URL",
+                         help="worker API base URL, e.g. http://10.0.0.5:8621 (repeatable)")
+    p_coord.add_argument("--catalog", default=os.path.join(OUTPUT_DIR, "cluster_catalog.jsonl"),
+                         help="central catalog of finished files (default: %(default)s)")
+    
+    args = parser.parse_args()
+    if args.trace:
+        TRACER.configure(args.trace, profile=args.profile, malloc=args.tracemalloc)
+    
+    if args.command == "clip":
+        try:
+            out = clip_recording(args.input, parse_timecode(args.start),
+                                 parse_timecode(args.end), args.output)
+        except Exception as e:
+            sys.exit(f"Error: {e}")
+        print(out)
+    elif args.command == "index":
+        try:
+            index = build_index(args.input)
+        except Exception as e:
+            sys.exit(f"Error: {e}")
+        print(f"{len(index)} keyframes indexed -> {index_path(args.input)}")
+    elif args.command == "archive":
+        ok, usage, error = archive_recording(args.input, ArchiveScheduler(args.workers))
+        TRACER.save()
+        if not ok:
+            sys.exit(f"Error: {error}")
+        print(f"{os.path.splitext(args.input)[0]}.mp4 ({format_usage(usage)}, "
+              f"{usage['wall_seconds']:.0f}s)")
+    elif args.command == "thumbnail":
+        if not FFMPEG_BIN:
+            sys.exit("Error: ffmpeg not found")
+        try:
+            path = THUMBS.generate(("file", args.input), args.count, args.width)
+            if path is None:
+                sys.exit(f"Error: no video keyframes could be decoded from {args.input}")
+            if args.output:
+                path = shutil.copyfile(path, args.output)
+        except OSError as e:
+            sys.exit(f"Error: {e}")
+        print(path)
+    elif args.command == "serve":
+        manager = JobManager(args.output_dir, args.slots, args.volume)
+        if len(manager.volumes) > 1:
+            VolumeMonitor(manager).start()
+        run_server(args.listen, manager, args.token)
+    elif args.command == "rebalance":
+        manager = JobManager(args.output_dir, volumes=args.volume)
+        try:
+            moved = set()
+            while True:
+                entry = manager.rebalance(args.threshold, exclude=moved)
+                if entry is None:
+                    break
+                moved.add(entry.get("job"))
+                print(f"{entry['name']} -> {entry['volume']}")
+        except OSError as e:
+            sys.exit(f"Error: {e}")
+    elif args.command == "startup-bench":
+        result = startup_benchmark(args.runs)
+        failures = []
+        if result["toolkit_imported"]:
+            failures.append("a GUI toolkit is imported at module level")
+        for phase, budget in STARTUP_BUDGET.items():
+            seconds = result[phase]
+            if seconds is None:
+                print(f"{phase}: skipped (no display)")
+                continue
+            print(f"{phase}: {seconds * 1000:.0f} ms (budget {budget * 1000:.0f} ms)")
+            if seconds > budget:
+                failures.append(f"{phase} over budget")
+        if failures:
+            sys.exit("Error: " + "; ".join(failures))
+    elif args.command == "coordinator":
+        coordinator = Coordinator(args.worker, args.catalog, token=args.token)
+        coordinator.start()
+        run_server(args.listen, coordinator, args.token)
     else:
-        run_ttk()
+        if args.api:
+            try:
+                start_control_server(args.api, token=args.token)
+            except Exception as e:
+                print(f"Control API not started: {e}", file=sys.stderr)
+        if len(JOBS.volumes) > 1:
+            VolumeMonitor(JOBS).start()
+        load_toolkit()
+        if USE_GTK:
+            run_gtk()
+        else:
+            run_ttk()
 
 if __name__ == "__main__":
     main()